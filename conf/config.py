@@ -1,6 +1,7 @@
 import json
 import logging
 import os
+import threading
 from logging.handlers import RotatingFileHandler
 
 
@@ -10,11 +11,14 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # 记录视频切割点和媒体素材哪些已使用，用于去重
 video_cut_points = dict()
 medias_used = dict()
+planned_timelines = dict()  # 已规划、尚未成功的任务的时间线：{任务名: {第几个视频: [各片段的时间线]}}，程序重启后直接复用
+state_lock = threading.RLock()  # 流水线中规划素材与持久化分属不同线程，读写上面三个变量时需持有该锁
 
 
 # ########## 加载配置
 def load_config():
-    config_path = os.path.join(BASE_DIR, "conf/config.json")
+    # 环境变量EASY_CLIP_CONFIG可指定其他配置文件，例如测试时使用临时的缓存文件夹
+    config_path = os.environ.get("EASY_CLIP_CONFIG") or os.path.join(BASE_DIR, "conf/config.json")
     if not os.path.exists(config_path):
         raise Exception('配置文件不存在，请根据config-template.json模板创建config.json文件')
 
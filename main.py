@@ -1,25 +1,48 @@
+import argparse
+import copy
 import datetime
 import itertools
 import os.path
 import pickle
 import random
-from typing import List, Dict
+import threading
+from typing import List, Dict, Callable
 
 import pandas
 
 try:
     import conf
     from conf.config import BASE_DIR, config, logger
-    from utils.audio_generation import text2audio, Subtitle
-    from utils.video_generation import generate_video, combining_video
+    from utils.audio_generation import sync_generate_audios, get_tts_recipe, Subtitle
+    from utils.capacity_planner import plan_capacity
+    from utils.loudness import loudness_index
+    from utils.media_cache import media_cache, get_script_media_dirs
+    from utils.media_index import media_index, similarity_history, to_media_pool, SimilarityGuard, get_script_key
+    from utils.memory import memory_guard
+    from utils.pipeline import Pipeline, Stage
+    from utils.progress import create_batch_progress
+    from utils.render_cache import render_cache, recipe_hash
+    from utils.seeding import derive_seed, get_task_seed
+    from utils.video_generation import plan_video, render_video, combining_video, get_audio_duration, get_segment_recipe, \
+        get_material_direction, get_rendition_path, get_timeline_duration, get_canvas_sizes
 except ModuleNotFoundError:
     import os
     import sys
     import conf
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))  # 离开IDE也能正常导入自己定义的包
     from conf.config import BASE_DIR, config, logger
-    from utils.audio_generation import text2audio, Subtitle
-    from utils.video_generation import generate_video, combining_video
+    from utils.audio_generation import sync_generate_audios, get_tts_recipe, Subtitle
+    from utils.capacity_planner import plan_capacity
+    from utils.loudness import loudness_index
+    from utils.media_cache import media_cache, get_script_media_dirs
+    from utils.media_index import media_index, similarity_history, to_media_pool, SimilarityGuard, get_script_key
+    from utils.memory import memory_guard
+    from utils.pipeline import Pipeline, Stage
+    from utils.progress import create_batch_progress
+    from utils.render_cache import render_cache, recipe_hash
+    from utils.seeding import derive_seed, get_task_seed
+    from utils.video_generation import plan_video, render_video, combining_video, get_audio_duration, get_segment_recipe, \
+        get_material_direction, get_rendition_path, get_timeline_duration, get_canvas_sizes
 
 
 def get_subtitles_list(subtitles: List):
@@ -43,91 +66,290 @@ def get_subtitles_list(subtitles: List):
     return text_list
 
 
-def subtitles2video(video_script_path: str, shuffle_subtitles: bool = False):
+def read_script_rows(video_script_path: str) -> List:
     """
-    字幕文件转视频文件
+    读取视频脚本文件
     :param video_script_path: 视频脚本文件的路径，.xlsx文件
-    :param shuffle_subtitles: 是否要打乱字幕顺序
-    :return:
+    :return: [[字幕, 素材文件夹, 封面文件夹, BGM文件夹], ...]
+    """
+    rows = pandas.read_excel(video_script_path, header=0)
+    return list(rows.values)
+
+
+def load_task(task: Dict) -> List[Dict]:
+    """
+    流水线阶段一：读取视频脚本文件，选定封面、BGM和配音人，拆分为待合成的视频
+    :param task: 任务，例：{"task_name": "...", "video_script_path": "...", "shuffle_subtitles": False}，
+                 也可以不给出video_script_path，直接给出视频脚本的内容"rows": [[字幕, 素材文件夹, 封面文件夹, BGM文件夹], ...]
+    :return: 待合成的视频列表
     """
+    video_script_path = task.get("video_script_path")
+    if "index" in task:
+        logger.info(f"准备合成：{task['task_name']} - 第{task['index']}个/共{task['total']}个")
 
     # 读取视频脚本文件
-    rows = pandas.read_excel(video_script_path, header=0)
-    rows = list(rows.values)
+    if video_script_path:
+        rows = read_script_rows(video_script_path)
+    else:
+        rows = task["rows"]
+
+    # 后台预取视频脚本引用的素材，渲染时直接读本地缓存，不再阻塞在网络读取上；预取后顺带建立素材索引，规划时直接查索引
+    media_cache.prefetch_dirs(get_script_media_dirs(rows), on_cached=media_index.prefetch_hook)
 
     subtitles = [Subtitle(text=row[0], metadata={"media_path": row[1]}) for row in rows]
 
+    # 任务的所有随机选择都来自由任务派生的随机数生成器，重跑结果一致
+    task_seed = get_task_seed(task, rows)
+    rng = random.Random(task_seed)
+
     # 封面路径
     cover_path = os.path.join(config["compose_params"]["media_root_path"], rows[0][2])
-    cover_path = random.choice(
-        [os.path.join(cover_path, filename) for filename in os.listdir(cover_path) if not filename.startswith(('.', 'Thumbs.db'))])
+    cover_path = rng.choice(media_cache.listdir(cover_path))
     logger.info(f"选择的封面：{cover_path}")
 
     # BGM路径
     bgm_path = os.path.join(config["compose_params"]["media_root_path"], rows[0][3])
-    bgm_path = random.choice(
-        [os.path.join(bgm_path, filename) for filename in os.listdir(bgm_path) if not filename.startswith(('.', 'Thumbs.db'))])
+    bgm_path = rng.choice(media_cache.listdir(bgm_path))
     logger.info(f"选择的bgm：{bgm_path}")
 
-    if shuffle_subtitles:
+    if task.get("shuffle_subtitles"):
         subtitles_list = get_subtitles_list(subtitles)
     else:
         subtitles_list = [subtitles, ]
 
-    for subtitles in subtitles_list:
+    jobs = list()
+    for job_index, subtitles in enumerate(subtitles_list):
         now = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
         os.makedirs(os.path.join(BASE_DIR, f"output/{now}"))  # 文件输出路径
 
+        job_rng = random.Random(derive_seed(task_seed, job_index))
+
         # 随机选一个字幕配音人
-        subtitle_voice = config["SUPPORTED_VOICES"][random.choice(list(config["SUPPORTED_VOICES"].keys()))]
+        subtitle_voice = config["SUPPORTED_VOICES"][job_rng.choice(list(config["SUPPORTED_VOICES"].keys()))]
         logger.info(f"选择的字幕配音人：{subtitle_voice}")
 
-        # 封面决定取横向还是竖向的素材
-        material_direction: str = "vertical" if "_vertical" in cover_path else "horizontal"
-
-        video_path_list = list()
-        audio_path_list = list()
-        subtitle_path_list = list()
-        for index, subtitle in enumerate(subtitles):
-            # 生成音频（附带字幕文件）
-            audio_output_path = os.path.join(BASE_DIR, f"output/{now}/{index+1}.mp3")
-            subtitle_output_path = os.path.join(BASE_DIR, f"output/{now}/{index+1}.srt")
-            audio_path_list.append(audio_output_path)
-            subtitle_path_list.append(subtitle_output_path)
-            text2audio(text=subtitle.text, subtitle_voice=subtitle_voice, audio_output_path=audio_output_path,
-                       subtitle_output_path=subtitle_output_path)
-            # 生成视频文件
-            video_output_path = os.path.join(BASE_DIR, f"output/{now}/{index+1}.mp4")
-            video_path_list.append(video_output_path)
-            generate_video(subtitle=subtitle, audio_path=audio_output_path, subtitle_path=subtitle_output_path,
-                           material_direction=material_direction, video_output_path=video_output_path)
-
-        # 组合片段，生成最终视频
-        video_output_final_path = os.path.join(BASE_DIR, f"output/{now}/{now}.mp4")
-        combining_video(video_path_list=video_path_list, audio_path_list=audio_path_list, subtitle_path_list=subtitle_path_list,
-                        cover_path=cover_path, bgm_path=bgm_path,
-                        video_output_path=video_output_final_path)
-
-
-def main():
+        jobs.append({
+            "task": task,
+            "index": job_index,
+            "now": now,
+            "cover_path": cover_path,
+            "bgm_path": bgm_path,
+            "subtitle_voice": subtitle_voice,
+            "material_direction": get_material_direction(cover_path),
+            "segments": [
+                {
+                    "index": index,
+                    "subtitle": subtitle,
+                    "audio_path": os.path.join(BASE_DIR, f"output/{now}/{index+1}.mp3"),
+                    "subtitle_path": os.path.join(BASE_DIR, f"output/{now}/{index+1}.srt"),
+                    "video_path": os.path.join(BASE_DIR, f"output/{now}/{index+1}.mp4"),
+                }
+                for index, subtitle in enumerate(subtitles)
+            ],
+            "segments_left": len(subtitles),
+            "lock": threading.Lock(),
+            "rng": job_rng,
+        })
+    task["jobs"] = jobs
+    task["jobs_left"] = len(jobs)
 
-    # 读取所有视频脚本文件
-    video_script_path_list = [
-        os.path.join(config["compose_params"]["media_root_path"], filename)
-        for filename in os.listdir(config["compose_params"]["media_root_path"])
-        if filename.endswith(('.xlsx', '.xls'))
-    ]
-    # 一个字幕要生成几个视频
-    videos_per_subtitles = config["compose_params"]["videos_per_subtitles"]
+    return jobs
 
-    # 持久化处理：程序重启时先读取持久化文件，再进行任务处理
-    persistent_file_path = os.path.join(BASE_DIR, f'output/{config["compose_params"]["media_root_path"]}.pkl'.replace('\\', ''))
+
+def synthesize_job(job: Dict) -> List[Dict]:
+    """
+    流水线阶段二：一次性并发生成视频所有片段的音频（附带字幕文件），已缓存的音频直接复用
+    :param job: 待合成的视频
+    :return:
+    """
+    segments = list()
+    for segment in job["segments"]:
+        segment["tts_key"] = recipe_hash(get_tts_recipe(text=segment["subtitle"].text, subtitle_voice=job["subtitle_voice"]))
+        if not (render_cache.load(f"{segment['tts_key']}.mp3", segment["audio_path"])
+                and render_cache.load(f"{segment['tts_key']}.srt", segment["subtitle_path"])):
+            segments.append(segment)
+
+    if segments:
+        sync_generate_audios(
+            text_list=[segment["subtitle"].text for segment in segments],
+            subtitle_voice=job["subtitle_voice"],
+            audio_output_path_list=[segment["audio_path"] for segment in segments],
+            subtitle_output_path_list=[segment["subtitle_path"] for segment in segments]
+        )
+        for segment in segments:
+            render_cache.save(f"{segment['tts_key']}.mp3", segment["audio_path"])
+            render_cache.save(f"{segment['tts_key']}.srt", segment["subtitle_path"])
+
+    return [job]
+
+
+def plan_job(job: Dict) -> List[Dict]:
+    """
+    流水线阶段三：规划每个片段的时间线，扇出为片段交给渲染阶段。
+    规划会消耗全局的素材去重状态，所以该阶段只用一个线程，且上游按任务顺序交付，结果与线程调度无关。
+    规划结果按任务名记录，随素材使用情况一起持久化；程序崩溃重跑时，已规划过的视频直接复用原来的时间线，
+    不会从已被消耗过的素材中重新规划，片段缓存可以命中
+    :param job: 待合成的视频
+    :return: 待渲染的片段列表
+    """
+    task_name = job["task"]["task_name"]
+    for segment in job["segments"]:
+        segment["duration"] = get_audio_duration(segment["audio_path"])
+
+    # 整个视频在同一把锁内规划并记录，持久化的快照中素材消耗与已记录的时间线始终一致
+    with conf.config.state_lock:
+        timelines = conf.config.planned_timelines.get(task_name, dict()).get(job["index"])
+        if timelines is not None and len(timelines) == len(job["segments"]):
+            logger.info(f"复用上次运行已规划的时间线：{task_name} - 第{job['index']+1}个视频")
+            for segment, timeline in zip(job["segments"], timelines):
+                segment["timeline"] = timeline
+        else:
+            # 同一视频内、以及同一脚本最近几个视频之间，避免选到近似重复的素材
+            script_key = get_script_key(job["task"])
+            guard = SimilarityGuard(media_index=media_index, threshold=config["media_index"]["similarity_threshold"],
+                                    history=similarity_history.get(script_key))
+            for segment in job["segments"]:
+                segment["timeline"] = plan_video(subtitle=segment["subtitle"],
+                                                 subtitle_filename=os.path.basename(segment["subtitle_path"]),
+                                                 audio_duration=segment["duration"],
+                                                 material_direction=job["material_direction"],
+                                                 guard=guard, rng=job["rng"])
+            # 常驻服务的任务名每次提交都不同，不会重跑，去重记录和时间线都无需持久化
+            similarity_history.add(script_key, guard.used_paths, persistent=job["task"].get("job_id") is None)
+            if job["task"].get("job_id") is None:
+                conf.config.planned_timelines.setdefault(task_name, dict())[job["index"]] = \
+                    [segment["timeline"] for segment in job["segments"]]
+
+    media_index.save()
+
+    return [(job, segment) for segment in job["segments"]]
+
+
+def render_segment(job_segment) -> List[Dict]:
+    """
+    流水线阶段四：渲染片段，配方相同的片段已渲染过时直接复用。视频的最后一个片段渲染完成后，把视频交给合成阶段（扇入）
+    :param job_segment: (待合成的视频, 片段)
+    :return:
+    """
+    job, segment = job_segment
+
+    # 开启流复制拼接时，封面在片段中叠加，各分辨率版本也在片段中由同一份画面编码，组合片段时无需再解码重编码；
+    # 否则宽高比相同的版本在组合片段时由主视频的画面缩放，宽高比不同的版本仍需在片段中按自己的画布排版
+    stream_copy_concat = config["compose_params"]["stream_copy_concat"]
+    cover_path = job["cover_path"] if stream_copy_concat else None
+    renditions = [rendition for rendition in config["compose_params"]["renditions"]
+                  if stream_copy_concat or rendition["name"] in get_canvas_sizes(config["compose_params"]["renditions"])]
+    # 片段在整个视频中的起始时间，画中画在片段中叠加时从这里接着播放，拼接后不会在片段边界处重新开始
+    time_offset = sum(get_timeline_duration(previous["timeline"]) for previous in job["segments"][:segment["index"]])
+
+    recipe = get_segment_recipe(timeline=segment["timeline"], text=segment["subtitle"].text,
+                                subtitle_voice=job["subtitle_voice"], material_direction=job["material_direction"],
+                                cover_path=cover_path, renditions=renditions, time_offset=time_offset)
+    segment_hash = recipe_hash(recipe)
+    outputs = {f"{segment_hash}.mp4": segment["video_path"]}  # {缓存键: 输出路径}
+    for rendition in renditions:
+        outputs[f"{segment_hash}_{rendition['name']}.mp4"] = get_rendition_path(segment["video_path"], rendition["name"])
+    if not all(render_cache.load(key, path) for key, path in outputs.items()):
+        with memory_guard:  # 内存超过上限时等待其他渲染结束，降低并发
+            render_video(timeline=segment["timeline"], audio_path=segment["audio_path"], subtitle_path=segment["subtitle_path"],
+                         video_output_path=segment["video_path"], material_direction=job["material_direction"],
+                         cover_path=cover_path, renditions=renditions, time_offset=time_offset)
+        for key, path in outputs.items():
+            render_cache.save(key, path)
+
+    with job["lock"]:
+        job["segments_left"] -= 1
+        is_last = job["segments_left"] == 0
+
+    return [job] if is_last else []
+
+
+def mux_job(job: Dict) -> List[Dict]:
+    """
+    流水线阶段五：组合片段，生成最终视频
+    :param job: 待合成的视频
+    :return:
+    """
+    video_output_final_path = os.path.join(BASE_DIR, f"output/{job['now']}/{job['now']}.mp4")
+    job["video_path"] = video_output_final_path
+    # 同一份合成画面输出多个分辨率版本，音频、素材规划和渲染都只做一次
+    with memory_guard:
+        job["rendition_paths"] = combining_video(
+            video_path_list=[segment["video_path"] for segment in job["segments"]],
+            audio_path_list=[segment["audio_path"] for segment in job["segments"]],
+            subtitle_path_list=[segment["subtitle_path"] for segment in job["segments"]],
+            cover_path=None if config["compose_params"]["stream_copy_concat"] else job["cover_path"],
+            bgm_path=job["bgm_path"],
+            video_output_path=video_output_final_path,
+            renditions=config["compose_params"]["renditions"])
+
+    return [job]
+
+
+def get_task(item) -> Dict:
+    """
+    获取流水线中任一阶段的产物所属的任务
+    :param item: 任务、待合成的视频或(待合成的视频, 片段)
+    :return:
+    """
+    if isinstance(item, tuple):
+        item = item[0]
+    return item.get("task", item)
+
+
+def build_pipeline(error_handler: Callable = None, monitor: Callable = None) -> Pipeline:
+    """
+    构建视频合成流水线：读取脚本 → 生成音频 → 规划时间线 → 渲染片段 → 合成最终视频
+    :param error_handler: 出错处理函数，见Pipeline
+    :param monitor: 耗时统计函数，见Pipeline
+    :return:
+    """
+    workers = config["pipeline"]["workers"]
+    queue_size = config["pipeline"]["queue_size"]
+
+    return Pipeline(stages=[
+        Stage(name="load", func=load_task, workers=1, queue_size=queue_size),
+        Stage(name="tts", func=synthesize_job, workers=workers["tts"], queue_size=queue_size, ordered=True),
+        Stage(name="plan", func=plan_job, workers=1, queue_size=queue_size),
+        Stage(name="render", func=render_segment, workers=workers["render"], queue_size=queue_size),
+        Stage(name="mux", func=mux_job, workers=workers["mux"], queue_size=queue_size),
+    ], error_handler=error_handler, monitor=monitor)
+
+
+def subtitles2video(video_script_path: str, shuffle_subtitles: bool = False):
+    """
+    字幕文件转视频文件
+    :param video_script_path: 视频脚本文件的路径，.xlsx文件
+    :param shuffle_subtitles: 是否要打乱字幕顺序
+    :return:
+    """
+    task = {"task_name": video_script_path, "video_script_path": video_script_path, "shuffle_subtitles": shuffle_subtitles}
+    for _ in build_pipeline().run([task, ]):
+        pass
+
+
+def get_persistent_file_path() -> str:
+    """
+    获取持久化文件的路径，按媒体素材根路径区分
+    :return:
+    """
+    return os.path.join(BASE_DIR, f'output/{config["compose_params"]["media_root_path"]}.pkl'.replace('\\', ''))
+
+
+def load_session(persistent_file_path: str) -> Dict:
+    """
+    读取持久化文件，不存在时新建
+    :param persistent_file_path: 持久化文件路径
+    :return:
+    """
     if not os.path.exists(persistent_file_path):
         logger.warning(f"新建持久化文件：{persistent_file_path}")
         with open(persistent_file_path, 'wb') as f:
             session: Dict = {
                 "video_cut_points": dict(),
                 "medias_used":  dict(),
+                "planned_timelines": dict(),
+                "similarity_history": dict(),
                 "success_tasks": list(),
             }
             pickle.dump(session, f)
@@ -137,13 +359,119 @@ def main():
             session: Dict = pickle.load(f, encoding='bytes')
         logger.warning(f"持久化文件内容：{session}")
 
+    return session
+
+
+def restore_session(session: Dict):
+    """
+    从持久化内容中恢复视频切割点、素材使用情况和已规划的时间线
+    :param session: 持久化内容
+    :return:
+    """
+    with conf.config.state_lock:
+        conf.config.video_cut_points = session.get("video_cut_points")
+        conf.config.medias_used = {key: to_media_pool(medias) for key, medias in session.get("medias_used").items()}
+        conf.config.planned_timelines = session.get("planned_timelines", dict())  # 旧持久化文件中没有
+        similarity_history.load(session.get("similarity_history", dict()))
+
+
+def save_session(persistent_file_path: str, task_name: str, record_success: bool = True):
+    """
+    持久化成功的任务及当前的视频切割点、素材使用情况和已规划的时间线。
+    规划阶段可能已在为后续任务消耗素材，这些任务的时间线与素材消耗在同一快照中写入，重跑时直接复用
+    :param persistent_file_path: 持久化文件路径
+    :param task_name: 成功的任务名
+    :param record_success: 是否记入成功的任务，常驻服务的任务名每次不同，只持久化素材使用情况
+    :return:
+    """
+    logger.info(f"开始持久化任务：{task_name}")
+    with open(persistent_file_path, 'rb') as f:
+        session: Dict = pickle.load(f, encoding='bytes')
+    with open(persistent_file_path, 'wb') as f:
+        if record_success:
+            session["success_tasks"].append(task_name)
+        with conf.config.state_lock:
+            conf.config.planned_timelines.pop(task_name, None)
+            session["video_cut_points"] = copy.deepcopy(conf.config.video_cut_points)
+            session["medias_used"] = copy.deepcopy(conf.config.medias_used)
+            session["planned_timelines"] = copy.deepcopy(conf.config.planned_timelines)
+            session["similarity_history"] = similarity_history.to_dict()
+        pickle.dump(session, f)
+
+
+def get_video_script_path_list() -> List[str]:
+    """
+    获取媒体素材根路径下所有视频脚本文件的路径
+    :return:
+    """
+    return [
+        os.path.join(config["compose_params"]["media_root_path"], filename)
+        for filename in os.listdir(config["compose_params"]["media_root_path"])
+        if filename.endswith(('.xlsx', '.xls'))
+    ]
+
+
+def analyze_bgm_loudness():
+    """
+    用进程池批量分析所有视频脚本引用的BGM的响度并写入响度索引，合成时直接按索引调整增益
+    :return:
+    """
+    bgm_paths = list()
+    for video_script_path in get_video_script_path_list():
+        rows = read_script_rows(video_script_path)
+        bgm_dir = os.path.join(config["compose_params"]["media_root_path"], rows[0][3])
+        for bgm_path in media_cache.listdir(bgm_dir):
+            if bgm_path not in bgm_paths:
+                bgm_paths.append(bgm_path)
+
+    loudness_index.analyze_all(bgm_paths)
+
+
+def build_media_index():
+    """
+    批量建立所有视频脚本引用的画面素材的索引，包括需要完整解码视频的镜头切换点（多进程，读本地副本），
+    合成时切割点据此对齐到镜头切换处
+    :return:
+    """
+    file_paths = list()
+    for video_script_path in get_video_script_path_list():
+        for row in read_script_rows(video_script_path):
+            media_dir = os.path.join(config["compose_params"]["media_root_path"], row[1])
+            for file_path in media_cache.listdir(media_dir):
+                if file_path not in file_paths:
+                    file_paths.append(file_path)
+
+    media_index.build_all(file_paths)
+
+
+def main(dry_run: bool = False):
+    """
+    合成媒体素材根路径下所有视频脚本的视频
+    :param dry_run: 是否试运行：只模拟素材消耗并推算耗时，不生成音频、不渲染，也不改动持久化文件
+    :return: 试运行时返回试运行报告
+    """
+
+    # 读取所有视频脚本文件
+    video_script_path_list = get_video_script_path_list()
+    # 一个字幕要生成几个视频
+    videos_per_subtitles = config["compose_params"]["videos_per_subtitles"]
+
+    # 持久化处理：程序重启时先读取持久化文件，再进行任务处理
+    persistent_file_path = get_persistent_file_path()
+    is_new_session = not os.path.exists(persistent_file_path)
+    if dry_run and is_new_session:
+        session = {"video_cut_points": dict(), "medias_used": dict(), "planned_timelines": dict(),
+                   "similarity_history": dict(), "success_tasks": list()}
+    else:
+        session = load_session(persistent_file_path)
+    if not is_new_session and not dry_run:
         res = input(f"本地已有持久化文件，是否继续【y/n】：")
         if res.lower() != 'y':
             return
 
-        conf.config.video_cut_points = session.get("video_cut_points")
-        conf.config.medias_used = session.get("medias_used")
+        restore_session(session)
 
+    tasks = list()
     for video_script_path in video_script_path_list:
         for i in range(videos_per_subtitles):
 
@@ -153,22 +481,50 @@ def main():
                 logger.info(f"跳过任务：{task_name}")
                 continue
 
-            logger.info(f"准备合成：{video_script_path} - 第{i+1}个/共{videos_per_subtitles}个")
-            subtitles2video(
-                video_script_path=video_script_path,
-                shuffle_subtitles=False
-            )
+            tasks.append({
+                "task_name": task_name,
+                "video_script_path": video_script_path,
+                "shuffle_subtitles": False,
+                "index": i + 1,
+                "total": videos_per_subtitles,
+            })
+
+    if dry_run:
+        for task in tasks:
+            task["rows"] = read_script_rows(task["video_script_path"])
+        return plan_capacity(tasks, medias_used=session["medias_used"], video_cut_points=session["video_cut_points"],
+                             planned_timelines=session.get("planned_timelines", dict()),
+                             similarity_history=session.get("similarity_history", dict()))
+
+    # 整批任务的进度、吞吐量和预计剩余时间，定期写入状态文件
+    progress = create_batch_progress(total_videos=len(tasks))
+    pipeline = build_pipeline(monitor=progress.on_stage_done)
+    progress.attach(pipeline)
+    progress.start()
+    try:
+        for job in pipeline.run(tasks):
+            progress.on_video_done(sum(segment["duration"] for segment in job["segments"]))
+
+            task = job["task"]
+            task["jobs_left"] -= 1
+            if task["jobs_left"] > 0:
+                continue
 
             # 持久化处理：成功的任务进行持久化
-            logger.info(f"开始持久化任务：{task_name}")
-            with open(persistent_file_path, 'rb') as f:
-                session: Dict = pickle.load(f, encoding='bytes')
-            with open(persistent_file_path, 'wb') as f:
-                session["success_tasks"].append(task_name)
-                session["video_cut_points"] = conf.config.video_cut_points
-                session["medias_used"] = conf.config.medias_used
-                pickle.dump(session, f)
+            save_session(persistent_file_path, task["task_name"])
+    finally:
+        progress.stop()
 
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="试运行：估算素材是否够用及合成耗时，不渲染")
+    parser.add_argument("--analyze-loudness", action="store_true", help="批量分析所有BGM的响度，写入响度索引")
+    parser.add_argument("--build-index", action="store_true", help="批量建立画面素材的索引，包括视频的镜头切换点")
+    args = parser.parse_args()
+    if args.analyze_loudness:
+        analyze_bgm_loudness()
+    elif args.build_index:
+        build_media_index()
+    else:
+        main(dry_run=args.dry_run)
@@ -0,0 +1,334 @@
+import itertools
+import json
+import os.path
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+try:
+    from conf.config import config, logger
+    from main import build_pipeline, get_task, get_persistent_file_path, load_session, restore_session, save_session
+    from utils.media_cache import media_cache
+    from utils.media_index import similarity_history
+    from utils.progress import create_batch_progress
+except ModuleNotFoundError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))  # 离开IDE也能正常导入自己定义的包
+    from conf.config import config, logger
+    from main import build_pipeline, get_task, get_persistent_file_path, load_session, restore_session, save_session
+    from utils.media_cache import media_cache
+    from utils.media_index import similarity_history
+    from utils.progress import create_batch_progress
+
+
+class JobServer(object):
+    def __init__(self):
+        """
+        常驻的视频合成服务。
+        进程常驻，重量级依赖、素材缓存和音频缓存始终处于预热状态；作业按优先级进入同一条常驻流水线
+        """
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict] = dict()
+        self._task_queue = queue.PriorityQueue()
+        self._sequence = itertools.count()  # 同优先级的作业先进先出
+        self._stopping = threading.Event()
+        self.max_finished_jobs = config["job_server"]["max_finished_jobs"]  # 最多保留多少个已结束的作业供查询
+
+        self._started_at = time.time()
+        self._completed_tasks = 0
+        self._failed_tasks = 0
+        self._output_seconds = 0.0
+
+        self._progress = create_batch_progress()  # 所有作业汇总的进度和预计剩余时间
+
+        self._persistent_file_path = get_persistent_file_path()
+        restore_session(load_session(self._persistent_file_path))  # 服务不交互确认，直接沿用已有的素材去重状态
+
+    def submit(self, params: Dict) -> Dict:
+        """
+        提交作业
+        :param params: 作业参数，例：{"script_path": "xxx.xlsx", "videos": 2, "priority": 0}
+                       或{"rows": [[字幕, 素材文件夹, 封面文件夹, BGM文件夹], ...], "videos": 2, "priority": 0}，
+                       priority越大越先执行；可选seed，给出相同的seed时重新提交能得到相同的视频，默认每个作业不同
+        :return: 作业
+        """
+        if not isinstance(params, dict):
+            raise ValueError("请求体必须是JSON对象")
+        script_path = params.get("script_path")
+        rows = params.get("rows")
+        if not script_path and not rows:
+            raise ValueError("script_path和rows不能同时为空")
+        if script_path and not os.path.isabs(script_path):
+            script_path = os.path.join(config["compose_params"]["media_root_path"], script_path)
+        if script_path and not os.path.exists(script_path):
+            raise ValueError(f"视频脚本文件不存在：{script_path}")
+        if not script_path and (not isinstance(rows, list)
+                                or not all(isinstance(row, list) and len(row) == 4 for row in rows)):
+            raise ValueError("rows必须是非空列表，每行为[字幕, 素材文件夹, 封面文件夹, BGM文件夹]")
+
+        videos = int(params.get("videos", 1))
+        if videos <= 0:
+            raise ValueError("videos必须是正整数")  # 没有任务的作业永远不会结束
+        priority = int(params.get("priority", 0))
+
+        job_id = uuid.uuid4().hex
+        seed = params.get("seed", job_id)
+        job = {
+            "job_id": job_id,
+            "script_path": script_path,
+            "videos": videos,
+            "priority": priority,
+            "status": "queued",
+            "tasks": list(),
+            "output_paths": list(),
+            "rendition_paths": list(),  # 额外输出的分辨率版本
+            "errors": list(),
+            "created_at": time.time(),
+            "finished_at": None,
+        }
+        for i in range(videos):
+            job["tasks"].append({
+                "task_name": f"{job_id}-{i+1}",
+                "job_id": job_id,
+                "video_script_path": script_path,
+                "rows": rows,
+                "shuffle_subtitles": False,
+                "index": i + 1,
+                "total": videos,
+                "seed": seed,
+                "status": "queued",
+            })
+
+        with self._lock:
+            self._jobs[job_id] = job
+        self._progress.add_total(videos)
+
+        media_cache.clear_listdir_cache()  # 共享目录可能新增了素材
+        for task in job["tasks"]:
+            self._task_queue.put((-priority, next(self._sequence), task))
+        logger.info(f"收到作业：{job_id}，视频数：{videos}，优先级：{priority}")
+
+        return self.get_job(job_id)
+
+    def get_job(self, job_id: str) -> Dict:
+        """
+        获取作业的状态与进度
+        :param job_id: 作业id
+        :return:
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+
+            segments_total = 0
+            segments_done = 0
+            for task in job["tasks"]:
+                for video in task.get("jobs", []):
+                    segments_total += len(video["segments"])
+                    segments_done += len(video["segments"]) - video["segments_left"]
+
+            return {
+                "job_id": job["job_id"],
+                "script_path": job["script_path"],
+                "priority": job["priority"],
+                "status": job["status"],
+                "videos_total": job["videos"],
+                "videos_done": len(job["output_paths"]),
+                "segments_total": segments_total,
+                "segments_done": segments_done,
+                "output_paths": list(job["output_paths"]),
+                "rendition_paths": list(job["rendition_paths"]),
+                "errors": list(job["errors"]),
+                "created_at": job["created_at"],
+                "finished_at": job["finished_at"],
+            }
+
+    def list_jobs(self) -> List[Dict]:
+        with self._lock:
+            job_ids = list(self._jobs.keys())
+        return [self.get_job(job_id) for job_id in job_ids]
+
+    def get_metrics(self) -> Dict:
+        """
+        获取服务指标：队列深度、任务数和吞吐量
+        :return:
+        """
+        with self._lock:
+            uptime = time.time() - self._started_at
+            running_tasks = sum(1 for job in self._jobs.values() for task in job["tasks"] if task["status"] == "running")
+            return {
+                "queue_depth": self._task_queue.qsize(),
+                "running_tasks": running_tasks,
+                "completed_tasks": self._completed_tasks,
+                "failed_tasks": self._failed_tasks,
+                "output_seconds": round(self._output_seconds, 2),
+                "uptime_seconds": round(uptime, 2),
+                "throughput": round(self._output_seconds / uptime, 4),  # 每秒合成的视频秒数
+                "videos_per_hour": round(self._completed_tasks / uptime * 3600, 2),
+            }
+
+    def get_progress(self) -> Dict:
+        """
+        获取所有作业汇总的进度：各阶段耗时、滚动吞吐量和预计剩余时间
+        :return:
+        """
+        return self._progress.get_status()
+
+    def _iter_tasks(self):
+        """
+        按优先级逐个取出任务交给流水线，队列为空时等待
+        :return:
+        """
+        while not self._stopping.is_set():
+            try:
+                _, _, task = self._task_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                task["status"] = "running"
+                self._jobs[task["job_id"]]["status"] = "running"
+            yield task
+
+    def _finish_task(self, task: Dict, error: Exception = None):
+        with self._lock:
+            if task["status"] != "running":  # 同一任务的多个片段可能先后出错
+                return
+
+            job = self._jobs[task["job_id"]]
+            if error is None:
+                task["status"] = "success"
+                self._completed_tasks += 1
+                for video in task["jobs"]:
+                    job["output_paths"].append(video["video_path"])
+                    job["rendition_paths"].extend(video.get("rendition_paths", {}).values())
+                    self._output_seconds += sum(segment["duration"] for segment in video["segments"])
+            else:
+                task["status"] = "failed"
+                self._failed_tasks += 1
+                self._progress.on_video_failed()
+                job["errors"].append(f"{task['task_name']}：{error}")
+
+            if all(task["status"] in ("success", "failed") for task in job["tasks"]):
+                job["status"] = "failed" if job["errors"] else "success"
+                job["finished_at"] = time.time()
+                logger.info(f"作业完成：{job['job_id']}，状态：{job['status']}")
+                similarity_history.remove(job["job_id"])  # 作业内视频之间的去重记录，见get_script_key
+                self._prune_jobs()
+
+    def _prune_jobs(self):
+        """
+        已结束的作业超过上限时，删除最早提交的，避免常驻进程的内存无限增长。调用方需持有self._lock
+        :return:
+        """
+        finished_job_ids = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished_job_ids[:max(0, len(finished_job_ids) - self.max_finished_jobs)]:
+            del self._jobs[job_id]
+
+    def _on_error(self, stage, item, error: Exception):
+        self._finish_task(get_task(item), error=error)
+
+    def run_forever(self):
+        """
+        运行常驻流水线，阻塞直至stop被调用
+        :return:
+        """
+        pipeline = build_pipeline(error_handler=self._on_error, monitor=self._progress.on_stage_done)
+        self._progress.attach(pipeline)
+        self._progress.start()
+        try:
+            for video in pipeline.run(self._iter_tasks()):
+                self._progress.on_video_done(sum(segment["duration"] for segment in video["segments"]))
+
+                task = video["task"]
+                task["jobs_left"] -= 1
+                if task["jobs_left"] > 0:
+                    continue
+
+                save_session(self._persistent_file_path, task["task_name"], record_success=False)
+                self._finish_task(task)
+        finally:
+            self._progress.stop()
+
+    def stop(self):
+        self._stopping.set()
+
+
+def make_request_handler(job_server: JobServer):
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        """
+        POST /jobs         提交作业
+        GET  /jobs         作业列表
+        GET  /jobs/<id>    作业进度
+        GET  /metrics      服务指标
+        GET  /progress     整体进度与预计剩余时间
+        """
+
+        def _send_json(self, status: int, data):
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path == "/metrics":
+                self._send_json(200, job_server.get_metrics())
+            elif path == "/progress":
+                self._send_json(200, job_server.get_progress())
+            elif path == "/jobs":
+                self._send_json(200, job_server.list_jobs())
+            elif path.startswith("/jobs/"):
+                job = job_server.get_job(path[len("/jobs/"):])
+                if job is None:
+                    self._send_json(404, {"error": "作业不存在"})
+                else:
+                    self._send_json(200, job)
+            else:
+                self._send_json(404, {"error": "接口不存在"})
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                self._send_json(404, {"error": "接口不存在"})
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                params = json.loads(self.rfile.read(length).decode("utf-8"))
+                job = job_server.submit(params)
+            except (ValueError, TypeError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(201, job)
+
+        def log_message(self, format, *args):
+            logger.info(f"{self.address_string()} - {format % args}")
+
+    return RequestHandler
+
+
+def main():
+    job_server = JobServer()
+    host = config["job_server"]["host"]
+    port = config["job_server"]["port"]
+
+    http_server = ThreadingHTTPServer((host, port), make_request_handler(job_server))
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    logger.info(f"视频合成服务已启动：http://{host}:{port}")
+
+    try:
+        job_server.run_forever()
+    except KeyboardInterrupt:
+        job_server.stop()
+    finally:
+        http_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
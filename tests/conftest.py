@@ -0,0 +1,33 @@
+import json
+import os
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)  # 离开IDE也能正常导入自己定义的包
+
+
+def _write_test_config() -> str:
+    """
+    由config-template.json生成测试用的配置文件：媒体素材根路径、各缓存和索引文件都放在临时文件夹，
+    干净的检出中无需先创建config.json，测试也不会写入项目根目录下的cache文件夹
+    :return: 配置文件路径
+    """
+    with open(os.path.join(BASE_DIR, "conf/config-template.json"), mode='r', encoding='utf-8') as f:
+        test_config = json.load(f)
+
+    tmp_dir = tempfile.mkdtemp(prefix="easy_clip_test_")
+    test_config["compose_params"]["media_root_path"] = os.path.join(tmp_dir, "media")
+    test_config["media_cache"]["cache_dir"] = os.path.join(tmp_dir, "cache/media")
+    test_config["render_cache"]["cache_dir"] = os.path.join(tmp_dir, "cache/render")
+    test_config["media_index"]["index_file"] = os.path.join(tmp_dir, "cache/media_index.json")
+    test_config["loudness"]["index_file"] = os.path.join(tmp_dir, "cache/loudness_index.json")
+    test_config["progress"]["status_file"] = os.path.join(tmp_dir, "output/status.json")
+
+    config_path = os.path.join(tmp_dir, "config.json")
+    with open(config_path, mode='w', encoding='utf-8') as f:
+        json.dump(test_config, f, ensure_ascii=False)
+    return config_path
+
+
+os.environ["EASY_CLIP_CONFIG"] = _write_test_config()  # 须在任何模块导入conf.config之前设置
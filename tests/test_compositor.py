@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from moviepy.video.VideoClip import VideoClip
+
+from utils.compositor import OPAQUE, BLEND, StaticLayer, ClipLayer, get_layer_box
+
+CANVAS_SIZE = (96, 64)
+
+
+def float_blend(canvas: np.ndarray, rgba: np.ndarray, origin_x: int, origin_y: int) -> np.ndarray:
+    """
+    逐像素的浮点alpha混合，作为参考结果
+    """
+    out = canvas.astype(np.float64)
+    height, width = rgba.shape[:2]
+    for y in range(height):
+        for x in range(width):
+            cy, cx = origin_y + y, origin_x + x
+            if 0 <= cy < canvas.shape[0] and 0 <= cx < canvas.shape[1]:
+                alpha = rgba[y, x, 3] / 255
+                out[cy, cx] = rgba[y, x, :3] * alpha + out[cy, cx] * (1 - alpha)
+    return np.round(out).astype(np.uint8)
+
+
+def random_rgba(rng: np.random.Generator, height: int, width: int) -> np.ndarray:
+    rgba = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    rgba[:, :width // 3, 3] = 0  # 全透明的分块
+    rgba[:height // 2, width // 3:2 * width // 3, 3] = 255  # 全不透明的分块
+    return rgba
+
+
+def test_get_layer_box_negative_and_named_positions():
+    assert get_layer_box(-10, -5, 20, 10, CANVAS_SIZE) == (66, 49, 66, 49, 86, 59)  # 距右边缘10、下边缘5
+    assert get_layer_box("center", "bottom", 20, 10, CANVAS_SIZE) == (38, 54, 38, 54, 58, 64)
+    assert get_layer_box(-5, 0, 200, 10, CANVAS_SIZE)[:2] == (-109, 0)  # 比画布宽时从左侧超出
+    assert get_layer_box(90, 60, 20, 10, CANVAS_SIZE)[2:] == (90, 60, 96, 64)  # 裁剪到画布内
+    _, _, x0, y0, x1, y1 = get_layer_box(100, 0, 20, 10, CANVAS_SIZE)
+    assert x1 <= x0  # 完全在画布外
+
+
+@pytest.mark.parametrize("x, y", [(0, 0), (7, 11), (-3, -9), (-40, 5), (80, -2), ("center", "center"), (200, 0)])
+def test_static_layer_matches_float_blend(x, y):
+    rng = np.random.default_rng(0)
+    rgba = random_rgba(rng, 45, 70)
+    canvas = rng.integers(0, 256, (CANVAS_SIZE[1], CANVAS_SIZE[0], 3), dtype=np.uint8)
+    origin_x, origin_y = get_layer_box(x, y, rgba.shape[1], rgba.shape[0], CANVAS_SIZE)[:2]
+    expected = float_blend(canvas, rgba, origin_x, origin_y)
+
+    frame = canvas.copy()
+    StaticLayer(rgba, x=x, y=y, canvas_size=CANVAS_SIZE, tile_size=16).draw(frame, 0)
+
+    assert np.abs(frame.astype(int) - expected).max() <= 1
+
+
+def test_static_layer_skips_transparent_tiles_and_copies_opaque_ones():
+    rgba = np.zeros((32, 64, 4), dtype=np.uint8)
+    rgba[:16, 16:32] = (10, 20, 30, 255)
+    rgba[16:, 48:] = (40, 50, 60, 128)
+    layer = StaticLayer(rgba, x=0, y=0, canvas_size=CANVAS_SIZE, tile_size=16)
+
+    assert [(rect[:5]) for rect in layer.rects] == [(0, 16, 16, 32, OPAQUE), (16, 32, 48, 64, BLEND)]
+
+    frame = np.full((CANVAS_SIZE[1], CANVAS_SIZE[0], 3), 200, dtype=np.uint8)
+    layer.draw(frame, 0)
+    assert (frame[:16, :16] == 200).all()  # 透明区域不变
+    assert (frame[:16, 16:32] == (10, 20, 30)).all()
+
+
+def test_static_layer_fully_transparent_or_off_canvas_draws_nothing():
+    assert StaticLayer(np.zeros((8, 8, 4), dtype=np.uint8), x=0, y=0, canvas_size=CANVAS_SIZE).rects == []
+    assert StaticLayer(np.full((8, 8, 4), 255, dtype=np.uint8), x=-200, y=0, canvas_size=CANVAS_SIZE).rects == []
+
+
+def solid_clip(size, value, duration=2.0, mask_value=None):
+    clip = VideoClip(lambda t: np.full((size[1], size[0], 3), value, dtype=np.uint8), duration=duration)
+    if mask_value is not None:
+        clip.mask = VideoClip(lambda t: np.full((size[1], size[0]), mask_value), ismask=True, duration=duration)
+    return clip
+
+
+def test_clip_layer_fade_in_blends_by_elapsed_time():
+    layer = ClipLayer(solid_clip((20, 10), 200), x=-5, y=-5, canvas_size=CANVAS_SIZE, start=1.0, fade_in=0.5)
+    frame = np.full((CANVAS_SIZE[1], CANVAS_SIZE[0], 3), 100, dtype=np.uint8)
+
+    layer.draw(frame, 0.5)  # 尚未开始
+    assert (frame == 100).all()
+
+    layer.draw(frame, 1.25)  # 淡入一半
+    assert np.abs(frame[49:59, 71:91].astype(int) - 150).max() <= 1
+    assert (frame[:49] == 100).all() and (frame[:, :71] == 100).all()
+
+
+def test_clip_layer_mask_blends_inside_layer_only():
+    # 比画布宽的图层，右边缘距画布右边缘20，左侧超出画布，只绘制可见部分
+    layer = ClipLayer(solid_clip((200, 10), 250, mask_value=0.4), x=-20, y=0, canvas_size=CANVAS_SIZE, loop=False)
+    frame = np.full((CANVAS_SIZE[1], CANVAS_SIZE[0], 3), 50, dtype=np.uint8)
+
+    layer.draw(frame, 0)
+
+    assert np.abs(frame[:10, :76].astype(int) - round(250 * 0.4 + 50 * 0.6)).max() <= 1
+    assert (frame[:10, 76:] == 50).all() and (frame[10:] == 50).all()
+
+    drawn = frame.copy()
+    layer.draw(frame, 5)  # 不循环时播放结束后不再绘制
+    assert (frame == drawn).all()
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from moviepy.audio.AudioClip import AudioClip
+
+from utils.loudness import LoudnessIndex
+from utils.media_cache import media_cache
+
+
+def test_analysis_on_miss_is_persisted(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_cache, "enable", False)  # 直接读本地临时文件
+    audio_path = str(tmp_path / "bgm.wav")
+    AudioClip(lambda t: np.sin(440 * 2 * np.pi * t) * 0.1, duration=2, fps=44100).write_audiofile(
+        audio_path, fps=44100, logger=None)
+    index_path = str(tmp_path / "loudness_index.json")
+
+    entry = LoudnessIndex(index_path=index_path).get(audio_path)
+
+    monkeypatch.setattr("utils.loudness.analyze_loudness", lambda *args: pytest.fail("新进程不应重复分析"))
+    assert LoudnessIndex(index_path=index_path).get(audio_path) == entry
+    assert abs(entry["lufs"] - -23.7) < 0.3  # 单声道正弦波，幅度0.1：-0.691 + 10 * log10(0.1 ** 2 / 2)
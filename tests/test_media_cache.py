@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+from utils.file_cache import FileCache
+from utils.media_cache import MediaCache
+
+
+def write_file(file_path: str, size: int, fill: bytes = b"x") -> str:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(fill * size)
+    return file_path
+
+
+def wait_until(predicate, timeout: float = 10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_file_cache_evicts_least_recently_used_by_bytes(tmp_path):
+    cache = FileCache(cache_dir=str(tmp_path / "cache"), max_bytes=250)
+    for name in ("a", "b"):
+        cache.put(f"{name}.bin", write_file(str(tmp_path / "src" / name), 100))
+
+    assert cache.get("a.bin")  # a变为最近使用，淘汰时先淘汰b
+    cache.put("c.bin", write_file(str(tmp_path / "src" / "c"), 100))
+
+    assert cache.get("b.bin") is None
+    assert not os.path.exists(tmp_path / "cache" / "b.bin")
+    assert cache.get("a.bin") and cache.get("c.bin")
+    assert cache.total_bytes == 200
+
+
+def test_file_cache_keeps_newest_file_over_budget(tmp_path):
+    cache = FileCache(cache_dir=str(tmp_path / "cache"), max_bytes=50)
+    local_path = cache.put("big.bin", write_file(str(tmp_path / "src" / "big"), 100))
+
+    assert cache.get("big.bin") == local_path
+
+
+def test_file_cache_restores_lru_order_after_restart(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    cache = FileCache(cache_dir=cache_dir, max_bytes=1000)
+    for name in ("a", "b", "c"):
+        cache.put(f"{name}.bin", write_file(str(tmp_path / "src" / name), 100))
+    for name, mtime in (("a", 3), ("b", 1), ("c", 2)):
+        os.utime(os.path.join(cache_dir, f"{name}.bin"), (mtime, mtime))
+    write_file(os.path.join(cache_dir, "d.bin.123.tmp"), 10)  # 上次异常退出残留的临时文件
+
+    cache = FileCache(cache_dir=cache_dir, max_bytes=250)
+
+    assert not os.path.exists(os.path.join(cache_dir, "d.bin.123.tmp"))
+    assert cache.get("b.bin") is None  # 最久未使用的被淘汰
+    assert cache.get("a.bin") and cache.get("c.bin")
+
+
+def test_read_through_copies_once_and_follows_remote_changes(tmp_path):
+    share = tmp_path / "share"
+    remote_path = write_file(str(share / "m1" / "1.jpg"), 100, b"a")
+    media_cache = MediaCache(cache_dir=str(tmp_path / "cache"), max_bytes=10000, prefetch_workers=2)
+
+    local_path = media_cache.get_local_path(remote_path)
+    assert local_path.startswith(str(tmp_path / "cache"))
+    assert open(local_path, "rb").read() == b"a" * 100
+    assert media_cache.get_local_path(remote_path) == local_path
+
+    write_file(remote_path, 120, b"b")  # 远程文件被替换
+    assert media_cache.get_local_path(remote_path) == local_path  # 文件状态在进程内缓存，不再访问远程
+
+    media_cache.clear_listdir_cache()  # 常驻服务每个作业开始时刷新
+    new_local_path = media_cache.get_local_path(remote_path)
+    assert new_local_path != local_path
+    assert open(new_local_path, "rb").read() == b"b" * 120
+
+
+def test_concurrent_reads_copy_remote_file_once(tmp_path):
+    remote_path = write_file(str(tmp_path / "share" / "m1" / "1.mp4"), 1000)
+    media_cache = MediaCache(cache_dir=str(tmp_path / "cache"), max_bytes=10000, prefetch_workers=2)
+
+    copies = list()
+    put = media_cache._file_cache.put
+
+    def slow_put(key, src_path, move=False):
+        copies.append(src_path)
+        time.sleep(0.2)
+        return put(key, src_path, move)
+
+    media_cache._file_cache.put = slow_put
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(media_cache.get_local_path(remote_path)))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert copies == [remote_path]
+    assert len(set(results)) == 1
+
+
+def test_prefetch_dirs_caches_every_file_in_background(tmp_path):
+    share = tmp_path / "share"
+    remote_paths = [write_file(str(share / "m1" / f"{i}.jpg"), 100) for i in range(5)] + \
+                   [write_file(str(share / "bgm" / "a.mp3"), 100)]
+    write_file(str(share / "m1" / "Thumbs.db"), 10)
+    media_cache = MediaCache(cache_dir=str(tmp_path / "cache"), max_bytes=10000, prefetch_workers=2)
+
+    media_cache.prefetch_dirs([str(share / "m1"), str(share / "bgm")])
+
+    cached = lambda: all(media_cache._file_cache.get(media_cache._cache_key(path)) for path in remote_paths)
+    assert wait_until(cached)
+    assert len(os.listdir(tmp_path / "cache")) == len(remote_paths)
+
+
+def test_prefetch_calls_on_cached_after_copy(tmp_path):
+    remote_paths = [write_file(str(tmp_path / "share" / "m1" / f"{i}.jpg"), 100) for i in range(3)]
+    media_cache = MediaCache(cache_dir=str(tmp_path / "cache"), max_bytes=10000, prefetch_workers=2)
+    cached = list()
+
+    def on_cached(file_path):
+        assert media_cache._file_cache.get(media_cache._cache_key(file_path))  # 回调时已有本地副本
+        cached.append(file_path)
+
+    media_cache.prefetch_dirs([str(tmp_path / "share" / "m1")], on_cached=on_cached)
+
+    assert wait_until(lambda: sorted(cached) == remote_paths)
+
+
+def test_listdir_is_sorted_and_filtered(tmp_path):
+    share = tmp_path / "share"
+    for name in ("b.jpg", "a.jpg", ".hidden.jpg", "Thumbs.db"):
+        write_file(str(share / name), 1)
+    media_cache = MediaCache(cache_dir=str(tmp_path / "cache"), max_bytes=10000, prefetch_workers=1)
+
+    assert media_cache.listdir(str(share)) == [str(share / "a.jpg"), str(share / "b.jpg")]
+
+
+def test_disabled_cache_reads_remote_path(tmp_path):
+    remote_path = write_file(str(tmp_path / "share" / "1.jpg"), 10)
+    media_cache = MediaCache(cache_dir=str(tmp_path / "cache"), max_bytes=10000, enable=False)
+
+    assert media_cache.get_local_path(remote_path) == remote_path
+    assert not os.path.exists(tmp_path / "cache")
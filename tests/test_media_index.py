@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+from PIL import Image
+from moviepy.video.VideoClip import ColorClip
+from moviepy.video.compositing.concatenate import concatenate_videoclips
+
+from utils.media_cache import media_cache, MediaCache
+from utils.media_index import MediaIndex, SimilarityGuard, SimilarityHistory, get_script_key
+
+
+class FakeMediaIndex(object):
+    def __init__(self, hashes):
+        self.hashes = hashes
+
+    def get_hashes(self, file_path):
+        return self.hashes[file_path]
+
+
+def test_same_image_is_similar_to_itself():
+    guard = SimilarityGuard(FakeMediaIndex({"v1/7.jpg": [0b1010]}), threshold=0)
+    guard.add("v1/7.jpg")
+
+    assert guard.is_similar("v1/7.jpg")
+
+
+def test_video_resumed_from_cut_point_is_not_similar_to_itself():
+    guard = SimilarityGuard(FakeMediaIndex({"v1/1.mp4": [0b1010, 0b0101]}), threshold=0)
+    guard.add("v1/1.mp4")
+
+    assert not guard.is_similar("v1/1.mp4")
+
+
+def test_near_duplicate_from_history_is_similar():
+    media_index = FakeMediaIndex({"v1/1.jpg": [0b1111], "v2/1.jpg": [0b1110], "v3/1.jpg": [0b0000]})
+    guard = SimilarityGuard(media_index, threshold=1, history=[["v1/1.jpg"]])
+
+    assert guard.is_similar("v2/1.jpg")
+    assert not guard.is_similar("v3/1.jpg")
+
+
+def test_server_job_history_is_not_persisted_and_is_removable():
+    history = SimilarityHistory(window=3)
+    script_task = {"task_name": "s-1", "video_script_path": "s.xlsx"}
+    server_task = {"task_name": "j-1", "job_id": "j", "video_script_path": "s.xlsx", "rows": None}
+    history.add(get_script_key(script_task), ["v1/1.jpg"])
+    history.add(get_script_key(server_task), ["v1/2.jpg"], persistent=False)
+
+    assert history.get("j") == [["v1/2.jpg"]]  # 作业内的视频之间仍然去重
+    assert history.to_dict() == {"s.xlsx": [["v1/1.jpg"]]}
+    history.remove("j")
+    assert history.get("j") == []
+
+
+@pytest.fixture
+def media_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_cache, "enable", False)  # 直接读本地临时文件夹
+    media_dir = tmp_path / "m1"
+    media_dir.mkdir()
+    Image.fromarray(np.zeros((40, 30, 3), dtype=np.uint8)).save(str(media_dir / "1.jpg"))
+    clips = [ColorClip((64, 36), color=color, duration=1) for color in ((255, 0, 0), (0, 0, 255))]
+    concatenate_videoclips(clips).write_videofile(str(media_dir / "2.mp4"), fps=25, codec="mpeg4", logger=None)
+    return media_dir
+
+
+def test_probe_does_not_decode_whole_video(media_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr("utils.media_index.detect_shot_boundaries", lambda *args: pytest.fail("规划时不应检测镜头切换"))
+    media_index = MediaIndex(index_path=str(tmp_path / "index.json"))
+
+    entry = media_index.get(str(media_dir / "2.mp4"))
+
+    assert (entry["width"], entry["height"]) == (64, 36)
+    assert "shots" not in entry
+    assert media_index.snap_cut_point(str(media_dir / "2.mp4"), 0.8, tolerance=0.5) == 0.8  # 未建立镜头切换点时不对齐
+
+
+def test_probe_reads_remote_file_without_copying(media_dir, tmp_path, monkeypatch):
+    cache = MediaCache(cache_dir=str(tmp_path / "cache"), max_bytes=10 ** 6, prefetch_workers=1)
+    monkeypatch.setattr("utils.media_index.media_cache", cache)
+    media_index = MediaIndex(index_path=str(tmp_path / "index.json"))
+
+    assert not media_index.is_vertical(str(media_dir / "2.mp4"))  # 试运行规划时的探测
+    assert media_index.is_vertical(str(media_dir / "1.jpg"))
+
+    assert cache.get_cached_path(str(media_dir / "2.mp4")) is None
+    assert not list((tmp_path / "cache").iterdir())
+
+
+def test_build_all_detects_shots_and_persists(media_dir, tmp_path):
+    index_path = str(tmp_path / "index.json")
+    MediaIndex(index_path=index_path, workers=1).build_all(
+        [str(media_dir / "1.jpg"), str(media_dir / "2.mp4"), str(media_dir / "Thumbs.db")])
+
+    media_index = MediaIndex(index_path=index_path)
+    shots = media_index.get(str(media_dir / "2.mp4"))["shots"]
+    assert len(shots) == 1 and abs(shots[0] - 1.0) < 0.3
+    assert media_index.snap_cut_point(str(media_dir / "2.mp4"), 0.7, tolerance=0.5) == shots[0]
+    assert "shots" not in media_index.get(str(media_dir / "1.jpg"))
@@ -0,0 +1,82 @@
+import gc
+import tracemalloc
+
+import numpy as np
+import pytest
+from PIL import Image
+from moviepy.video.VideoClip import ColorClip
+from moviepy.video.io.VideoFileClip import VideoFileClip
+
+from utils.compositor import StaticLayer, ClipLayer, render_layers
+from utils.memory import get_rss
+from utils.tools import ken_burns_clip
+from utils.video_generation import get_cross_fade_layers, resize_clip, close_clips
+
+CANVAS_SIZE = (360, 640)
+MATERIAL_SIZE = (360, 200)  # 横向素材，居中放在竖向画布上
+
+
+@pytest.fixture(scope="module")
+def materials(tmp_path_factory):
+    media_dir = tmp_path_factory.mktemp("media")
+    image_path = str(media_dir / "1.jpg")
+    Image.fromarray(np.random.default_rng(0).integers(0, 255, (480, 720, 3), dtype=np.uint8)).save(image_path)
+    video_path = str(media_dir / "1.mp4")
+    ColorClip((160, 96), color=(200, 30, 30), duration=2).write_videofile(video_path, fps=30, codec="mpeg4", logger=None)
+    logo = np.zeros((40, 80, 4), dtype=np.uint8)
+    logo[5:35, 5:75] = (255, 255, 255, 128)
+    return {"image": image_path, "video": video_path, "logo": logo}
+
+
+def build_variant(materials, seed: int):
+    """
+    按与render_video相同的方式组合一个视频：推拉摇移的图片、缩放的视频、交叉淡化、字幕和台标
+    """
+    rng = np.random.default_rng(seed)
+    opened_clips = list()
+    image_clip = ken_burns_clip(materials["image"], size=MATERIAL_SIZE, duration=1,
+                                zoom_start=1.0, zoom_end=1.0 + rng.uniform(0.05, 0.3))
+    video_clip = VideoFileClip(materials["video"], audio=False)
+    opened_clips.extend([image_clip, video_clip])
+    video_clip = resize_clip(video_clip.subclip(0, 1), size=MATERIAL_SIZE)
+    opened_clips.append(video_clip)
+
+    layers, duration = get_cross_fade_layers([image_clip, video_clip], canvas_size=CANVAS_SIZE, cross_fade_duration=0.5)
+    subtitle = ColorClip((200, 40), color=(255, 255, 255), duration=duration).add_mask()
+    layers.append(ClipLayer(subtitle, x="center", y=-40, canvas_size=CANVAS_SIZE, loop=False))
+    layers.append(StaticLayer(materials["logo"], x=-10, y=10, canvas_size=CANVAS_SIZE))
+
+    final_clip = render_layers(layers, canvas_size=CANVAS_SIZE, duration=duration)
+    opened_clips.append(final_clip)
+    return final_clip, opened_clips
+
+
+def test_composited_frames_reuse_buffers(materials):
+    final_clip, opened_clips = build_variant(materials, seed=0)
+    frame_bytes = CANVAS_SIZE[0] * CANVAS_SIZE[1] * 3
+    try:
+        final_clip.get_frame(0)
+        tracemalloc.start()
+        for t in np.arange(0, final_clip.duration, 1 / 30):  # 覆盖转场和两个素材
+            final_clip.get_frame(t)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        close_clips(opened_clips)
+
+    assert peak < frame_bytes / 2  # 每帧不再分配整帧的画布、遮罩和缩放结果
+
+
+def test_rendering_many_variants_keeps_memory_flat(materials, tmp_path):
+    rss = list()
+    for i in range(12):
+        final_clip, opened_clips = build_variant(materials, seed=i)
+        try:
+            final_clip.write_videofile(str(tmp_path / f"{i}.mp4"), fps=30, codec="mpeg4", audio=False, logger=None)
+        finally:
+            close_clips(opened_clips)
+        gc.collect()
+        rss.append(get_rss())
+
+    warmed_up = rss[3]  # 前几次会建立帧缓冲区池、加载编解码器
+    assert max(rss[4:]) - warmed_up < 20 * 1024 ** 2
@@ -0,0 +1,81 @@
+import random
+import threading
+import time
+
+import pytest
+
+from utils.pipeline import Pipeline, Stage
+
+
+def sleep_randomly(seed: int):
+    time.sleep(random.Random(seed).uniform(0, 0.02))
+
+
+def test_ordered_stage_keeps_input_order_with_random_delays():
+    def slow_double(x):
+        sleep_randomly(x)
+        return [x * 2]
+
+    consumed = list()
+
+    def consume(x):  # 单线程消耗全局状态，与规划阶段相同
+        consumed.append(x)
+        return [x]
+
+    pipeline = Pipeline([Stage("double", slow_double, workers=4, ordered=True),
+                         Stage("consume", consume, workers=1)])
+    results = list(pipeline.run(range(40)))
+
+    assert consumed == [x * 2 for x in range(40)]
+    assert results == consumed
+
+
+def test_fan_out_and_fan_in_end_every_stage():
+    jobs = [{"id": i, "left": 3, "lock": threading.Lock()} for i in range(5)]
+
+    def fan_out(job):
+        return [(job, segment) for segment in range(job["left"])]
+
+    def render(job_segment):  # 最后一个片段完成时交出整个视频，与render_segment相同
+        job, _ = job_segment
+        sleep_randomly(job["id"])
+        with job["lock"]:
+            job["left"] -= 1
+            return [job] if job["left"] == 0 else []
+
+    pipeline = Pipeline([Stage("plan", fan_out), Stage("render", render, workers=3),
+                         Stage("mux", lambda job: [job["id"]], workers=2)])
+
+    assert sorted(pipeline.run(jobs)) == list(range(5))
+
+
+def test_error_without_handler_stops_the_run_and_reraises():
+    processed = list()
+
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("boom")
+        processed.append(x)
+        return [x]
+
+    pipeline = Pipeline([Stage("fail", fail_on_three, workers=2, ordered=True), Stage("pass", lambda x: [x])])
+
+    with pytest.raises(ValueError, match="boom"):
+        list(pipeline.run(range(1000)))
+    assert len(processed) < 999  # 出错后不再处理剩余的产物
+
+
+def test_error_with_handler_drops_only_that_item():
+    errors = list()
+
+    def fail_on_three(x):
+        sleep_randomly(x)
+        if x == 3:
+            raise ValueError("boom")
+        return [x]
+
+    pipeline = Pipeline([Stage("fail", fail_on_three, workers=3, ordered=True), Stage("pass", lambda x: [x])],
+                        error_handler=lambda stage, item, e: errors.append((stage.name, item, str(e))))
+
+    assert list(pipeline.run(range(10))) == [0, 1, 2, 4, 5, 6, 7, 8, 9]
+    assert errors == [("fail", 3, "boom")]
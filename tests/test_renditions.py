@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from moviepy.audio.AudioClip import AudioClip
+from moviepy.video.VideoClip import VideoClip
+
+from conf.config import config
+from utils.video_generation import get_canvas_sizes, get_canvas_layout, get_material_size, get_video_stream_info, \
+    write_video
+
+MASTER_SIZE = (config["compose_params"]["background_width"], config["compose_params"]["background_height"])
+
+
+def solid_clip(size, value, duration=0.5):
+    return VideoClip(lambda t: np.full((size[1], size[0], 3), value, dtype=np.uint8), duration=duration)
+
+
+def test_only_other_aspect_renditions_get_their_own_canvas():
+    renditions = [{"name": "half", "width": MASTER_SIZE[0] // 2, "height": MASTER_SIZE[1] // 2},
+                  {"name": "landscape", "width": MASTER_SIZE[1], "height": MASTER_SIZE[0]}]
+
+    assert get_canvas_sizes(renditions) == {None: MASTER_SIZE, "landscape": (MASTER_SIZE[1], MASTER_SIZE[0])}
+
+
+def test_master_layout_matches_config():
+    assert get_canvas_layout(MASTER_SIZE) == (1, 0, 0)
+    for direction in ("horizontal", "vertical"):
+        assert get_material_size(direction, MASTER_SIZE) == get_material_size(direction)
+
+
+def test_landscape_canvas_pillarboxes_master_layout():
+    landscape = (MASTER_SIZE[1], MASTER_SIZE[0])  # 竖屏主视频的横屏版本
+    scale, margin_x, margin_y = get_canvas_layout(landscape)
+
+    assert margin_y == 0 and margin_x == round((landscape[0] - MASTER_SIZE[0] * scale) / 2)
+    assert get_material_size("vertical", landscape) == (round(MASTER_SIZE[0] * scale), landscape[1])
+    width, height = get_material_size("horizontal", landscape)
+    assert width <= landscape[0] and height <= landscape[1] and (width == landscape[0] or height == landscape[1])
+
+
+@pytest.fixture
+def master_clip():
+    size = (64, 112)
+    clip = solid_clip(size, 200)
+    return clip.set_audio(AudioClip(lambda t: np.zeros((np.size(t), 2)), duration=clip.duration, fps=44100))
+
+
+def test_write_video_encodes_each_aspect_in_parallel(master_clip, tmp_path):
+    renditions = [{"name": "small", "width": 32, "height": 56}, {"name": "landscape", "width": 112, "height": 64}]
+    rendition_paths = write_video(master_clip, str(tmp_path / "1.mp4"), renditions=renditions,
+                                  rendition_clips={"landscape": solid_clip((112, 64), 50)})
+
+    for rendition in renditions:
+        info = get_video_stream_info(rendition_paths[rendition["name"]])
+        assert (info["width"], info["height"]) == (rendition["width"], rendition["height"])
+
+
+def test_write_video_rejects_other_aspect_without_its_canvas(master_clip, tmp_path):
+    with pytest.raises(ValueError):
+        write_video(master_clip, str(tmp_path / "1.mp4"), renditions=[{"name": "landscape", "width": 112, "height": 64}])
@@ -1,13 +1,11 @@
 import asyncio
-import os
 import re
 import textwrap
 from typing import List, Tuple, Dict
 
 import edge_tts
-from pydub import AudioSegment
 
-from conf.config import config, logger, BASE_DIR
+from conf.config import config, logger
 
 
 class Subtitle(object):
@@ -147,12 +145,10 @@ def sync_generate_audios(text_list: List, subtitle_voice: str, audio_output_path
     :param subtitle_output_path_list: srt字幕输出的绝对路径列表，[/xxx/xxx/xxx.srt, /xxx/xxx/aaa.srt, ...]
     :return:
     """
-    loop = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()  # 流水线的工作线程中没有默认的事件循环，每次调用都新建一个
 
     try:
-        if not loop.is_running():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+        asyncio.set_event_loop(loop)
 
         tasks = list()
         for i in range(len(text_list)):
@@ -165,6 +161,20 @@ def sync_generate_audios(text_list: List, subtitle_voice: str, audio_output_path
         loop.close()
 
 
+def get_tts_recipe(text: str, subtitle_voice: str) -> Dict:
+    """
+    获取音频（附带字幕文件）的配方，配方相同的音频可直接复用
+    :param text: 待转化为音频的文本
+    :param subtitle_voice: 字幕配音人
+    :return:
+    """
+    return {
+        "text": text,
+        "subtitle_voice": subtitle_voice,
+        "subtitle_length_limit": config["compose_params"]["subtitle_length_limit"],  # 影响字幕文件的断句
+    }
+
+
 def text2audio(text: str, subtitle_voice: str, audio_output_path: str, subtitle_output_path: str) -> None:
     """
     将文本转为音频
@@ -180,36 +190,3 @@ def text2audio(text: str, subtitle_voice: str, audio_output_path: str, subtitle_
         audio_output_path_list=[audio_output_path, ],
         subtitle_output_path_list=[subtitle_output_path, ]
     )
-
-
-def audio_normalize(file_path: str, output_path: str = None,
-                    target_dbfs_limit: int = config["compose_params"]["bgm_target_dbfs_limit"]) -> str:
-    """
-    音频的音强（分贝值）标准化
-    :param file_path: 音频全路径
-    :param output_path: 文件输出路径
-    :param target_dbfs_limit: 目标分贝限值
-    :return:
-    """
-    if not output_path:
-        file_path_without_extension, extension = os.path.splitext(file_path)
-        output_path = f"{file_path_without_extension}_normalize{extension}"
-
-    sound = AudioSegment.from_file(file_path)
-
-    diff_dbfs = target_dbfs_limit - sound.max_dBFS
-    normalized_sound = sound.apply_gain(diff_dbfs)
-
-    normalized_sound.export(output_path, format="mp3")
-    logger.info(f"音频标准化后路径：{output_path}")
-
-    return output_path
-
-
-def main():
-    file_path = os.path.join(BASE_DIR, "example/1.mp3")
-    audio_normalize(file_path=file_path)
-
-
-if __name__ == "__main__":
-    main()
@@ -0,0 +1,142 @@
+import copy
+import os
+import random
+from typing import Dict, List, Tuple
+
+from conf.config import config, logger
+from utils.audio_generation import Subtitle, get_tts_recipe, remove_punctuation
+from utils.media_cache import media_cache
+from utils.media_index import media_index, SimilarityGuard, SimilarityHistory, get_script_key
+from utils.render_cache import render_cache, recipe_hash
+from utils.seeding import derive_seed, get_task_seed
+from utils.video_generation import plan_video, get_audio_duration, get_material_direction
+
+
+def estimate_audio_duration(text: str, subtitle_voice: str) -> float:
+    """
+    估算文本的配音时长：该配音人的音频已缓存时直接读取其时长，否则按每秒字数估算
+    :param text: 字幕文本
+    :param subtitle_voice: 正式运行时选中的配音人，不同配音人语速不同
+    :return: 秒
+    """
+    cache_path = render_cache.get_path(f"{recipe_hash(get_tts_recipe(text=text, subtitle_voice=subtitle_voice))}.mp3")
+    if cache_path:
+        return get_audio_duration(cache_path)
+
+    return len(remove_punctuation(text)) / config["capacity_planner"]["chars_per_second"]
+
+
+def project_seconds(output_seconds: float) -> Dict:
+    """
+    按基准吞吐量推算各阶段的耗时。流水线各阶段并行，总耗时取决于最慢的阶段
+    :param output_seconds: 要合成的视频总时长（秒）
+    :return: 例：{"tts": 60.0, "render": 3600.0, "mux": 300.0, "total": 3600.0, "bottleneck": "render"}
+    """
+    workers = config["pipeline"]["workers"]
+    throughput = config["capacity_planner"]["throughput"]
+
+    projected = {stage: round(output_seconds / (throughput[stage] * workers[stage]), 2) for stage in ("tts", "render", "mux")}
+    bottleneck = max(projected, key=projected.get)
+    projected["total"] = projected[bottleneck]
+    projected["bottleneck"] = bottleneck
+
+    return projected
+
+
+def plan_capacity(tasks: List[Dict], medias_used: Dict, video_cut_points: Dict, planned_timelines: Dict = None,
+                  similarity_history: Dict = None) -> Dict:
+    """
+    试运行：不生成音频、不渲染，在素材使用情况的副本上模拟所有任务的素材消耗，
+    提前找出素材会用完的视频脚本，并推算合成耗时。
+    与正式运行用同样的任务随机种子、同样的相似素材判断和跨视频去重记录，封面与正式运行一致；
+    素材的选取还取决于配音时长，配音已缓存时与正式运行一致，否则按字数估算的时长规划
+    :param tasks: 任务列表，例：[{"task_name": "...", "video_script_path": "...", "index": 1, "rows": [[字幕, 素材文件夹, 封面文件夹, BGM文件夹], ...]}, ...]
+    :param medias_used: 当前的素材使用情况，不会被修改
+    :param video_cut_points: 当前的视频切割点，不会被修改
+    :param planned_timelines: 上次运行已规划、尚未成功的任务的时间线，重跑时直接复用，素材消耗已计入medias_used
+    :param similarity_history: 持久化的跨视频去重记录，见SimilarityHistory.to_dict，不会被修改
+    :return: 试运行报告
+    """
+    medias_used = copy.deepcopy(medias_used)
+    video_cut_points = copy.deepcopy(video_cut_points)
+    planned_timelines = planned_timelines or dict()
+    history = SimilarityHistory(window=config["media_index"]["variant_window"])
+    history.load(similarity_history or dict())
+
+    durations: Dict[Tuple[str, str], float] = dict()  # 同一配音人的同一字幕文本只估算一次
+    scripts: Dict[str, Dict] = dict()
+    for task in tasks:
+        rows = task["rows"]
+        script = scripts.setdefault(task["video_script_path"], {
+            "script_path": task["video_script_path"],
+            "videos": 0,
+            "failed_videos": 0,
+            "output_seconds": 0.0,
+            "exhausted": list(),
+        })
+
+        # 按正式运行的顺序抽取随机数：封面、BGM，再是配音人
+        task_seed = get_task_seed(task, rows)
+        rng = random.Random(task_seed)
+        cover_path = os.path.join(config["compose_params"]["media_root_path"], rows[0][2])
+        material_direction = get_material_direction(rng.choice(media_cache.listdir(cover_path)))
+        rng.choice(media_cache.listdir(os.path.join(config["compose_params"]["media_root_path"], rows[0][3])))
+        job_rng = random.Random(derive_seed(task_seed, 0))
+        subtitle_voice = config["SUPPORTED_VOICES"][job_rng.choice(list(config["SUPPORTED_VOICES"].keys()))]
+
+        if 0 in planned_timelines.get(task["task_name"], dict()):  # 正式运行时复用已规划的时间线，不再消耗素材
+            script["videos"] += 1
+            script["output_seconds"] += sum(estimate_audio_duration(row[0], subtitle_voice) for row in rows)
+            continue
+
+        # 与正式运行一样避开近似重复的素材，重新选取会多消耗随机数，不判断时后续的选取就与正式运行不一致
+        script_key = get_script_key(task)
+        guard = SimilarityGuard(media_index=media_index, threshold=config["media_index"]["similarity_threshold"],
+                                history=history.get(script_key))
+        video_duration = 0.0
+        is_exhausted = False
+        for index, row in enumerate(rows):
+            subtitle = Subtitle(text=row[0], metadata={"media_path": row[1]})
+            duration_key = (subtitle.text, subtitle_voice)
+            if duration_key not in durations:
+                durations[duration_key] = estimate_audio_duration(subtitle.text, subtitle_voice)
+
+            try:
+                plan_video(subtitle=subtitle, subtitle_filename=f"{index+1}.srt",  # 与流水线中的去重键一致
+                           audio_duration=durations[duration_key], material_direction=material_direction,
+                           guard=guard, medias_used=medias_used, video_cut_points=video_cut_points, rng=job_rng)
+            except ValueError as e:
+                script["exhausted"].append({"task_name": task["task_name"], "segment": index + 1,
+                                            "media_path": row[1], "error": str(e)})
+                is_exhausted = True
+                break
+            video_duration += durations[duration_key]
+
+        if is_exhausted:
+            script["failed_videos"] += 1
+        else:
+            script["videos"] += 1
+            script["output_seconds"] += video_duration
+            history.add(script_key, guard.used_paths)
+
+    media_index.save()  # 模拟时新分析的素材，正式运行时直接复用
+
+    output_seconds = sum(script["output_seconds"] for script in scripts.values())
+    report = {
+        "scripts": list(scripts.values()),
+        "videos": sum(script["videos"] for script in scripts.values()),
+        "failed_videos": sum(script["failed_videos"] for script in scripts.values()),
+        "output_seconds": round(output_seconds, 2),
+        "projected_seconds": project_seconds(output_seconds),
+    }
+
+    for script in report["scripts"]:
+        if script["exhausted"]:
+            first = script["exhausted"][0]
+            logger.warning(f"素材不足：{script['script_path']}，{script['failed_videos']}个视频无法合成，"
+                           f"最早在{first['task_name']}的第{first['segment']}段（素材文件夹：{first['media_path']}）")
+    logger.info(f"试运行完成：可合成{report['videos']}个视频，共{report['output_seconds']}秒，"
+                f"{report['failed_videos']}个视频素材不足；预计耗时{report['projected_seconds']['total']}秒，"
+                f"瓶颈阶段：{report['projected_seconds']['bottleneck']}")
+
+    return report
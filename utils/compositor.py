@@ -0,0 +1,205 @@
+from typing import List, Tuple, Union
+
+import cv2
+import numpy as np
+from moviepy.video.VideoClip import VideoClip
+
+from utils.memory import FrameRing
+
+OPAQUE = "opaque"  # 全不透明：直接覆盖
+BLEND = "blend"  # 半透明：预乘alpha混合
+
+
+def get_layer_box(x: Union[int, str], y: Union[int, str], width: int, height: int,
+                  canvas_size: Tuple[int, int]) -> Tuple[int, int, int, int, int, int]:
+    """
+    计算图层在画布上的位置，并裁剪到画布内
+    :param x: 图层左上角横坐标，负数表示图层右边缘距画布右边缘的距离，也可以是"left"、"center"、"right"
+    :param y: 图层左上角纵坐标，负数表示图层下边缘距画布下边缘的距离，也可以是"top"、"center"、"bottom"
+    :param width: 图层宽
+    :param height: 图层高
+    :param canvas_size: 画布尺寸(width, height)
+    :return: (图层左上角横坐标, 纵坐标, 可见区域x0, y0, x1, y1)，不可见时可见区域的宽或高不大于0
+    """
+    canvas_width, canvas_height = canvas_size
+    # 按名称对齐时与moviepy的取整方式一致
+    if isinstance(x, str):
+        origin_x = int({"left": 0, "center": (canvas_width - width) / 2, "right": canvas_width - width}[x])
+    else:
+        origin_x = x if x >= 0 else canvas_width - width + x
+    if isinstance(y, str):
+        origin_y = int({"top": 0, "center": (canvas_height - height) / 2, "bottom": canvas_height - height}[y])
+    else:
+        origin_y = y if y >= 0 else canvas_height - height + y
+    return (origin_x, origin_y, max(0, origin_x), max(0, origin_y),
+            min(canvas_width, origin_x + width), min(canvas_height, origin_y + height))
+
+
+class StaticLayer(object):
+    def __init__(self, rgba: np.ndarray, x: int, y: int, canvas_size: Tuple[int, int], tile_size: int = 32,
+                 start: float = 0, end: float = None):
+        """
+        静态图层（封面、台标、贴纸）。
+        创建时一次性完成：裁剪到非透明像素的包围盒及画布内、预乘alpha、按分块区分全透明（跳过）、全不透明（直接覆盖）和半透明（混合），
+        同一行相邻的同类分块合并成一个矩形。每帧的开销只与图层的可见面积成正比，与画面大小无关
+        :param rgba: RGBA图像，uint8
+        :param x: 左上角横坐标，负数表示从右边缘算起，见get_layer_box
+        :param y: 左上角纵坐标，负数表示从下边缘算起
+        :param canvas_size: 画布尺寸(width, height)
+        :param tile_size: 分块边长
+        :param start: 开始显示的时间
+        :param end: 结束显示的时间，为空表示一直显示
+        """
+        self.start = start
+        self.end = end
+        self.rects: List[Tuple] = list()  # (画布y0, y1, x0, x1, 类型, 预乘rgb, 255-alpha)
+
+        height, width = rgba.shape[:2]
+        origin_x, origin_y, x0, y0, x1, y1 = get_layer_box(x, y, width, height, canvas_size)
+        if x1 <= x0 or y1 <= y0:
+            return
+        rgba = rgba[y0 - origin_y:y1 - origin_y, x0 - origin_x:x1 - origin_x]
+
+        # 裁剪到非透明像素的包围盒
+        alpha = rgba[..., 3]
+        rows, cols = np.nonzero(alpha.any(axis=1))[0], np.nonzero(alpha.any(axis=0))[0]
+        if len(rows) == 0:
+            return
+        rgba = rgba[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        x0, y0 = x0 + cols[0], y0 + rows[0]
+
+        alpha = rgba[..., 3:4].astype(np.uint16)
+        premultiplied = ((rgba[..., :3].astype(np.uint16) * alpha + 127) // 255).astype(np.uint8)
+        inverse_alpha = (255 - alpha).astype(np.uint16)
+
+        height, width = rgba.shape[:2]
+        for tile_y in range(0, height, tile_size):
+            run = None  # 同一行中正在合并的连续同类分块：[起始x, 结束x, 类型]
+            for tile_x in range(0, width, tile_size):
+                tile_alpha = rgba[tile_y:tile_y + tile_size, tile_x:tile_x + tile_size, 3]
+                if not tile_alpha.any():
+                    kind = None
+                elif (tile_alpha == 255).all():
+                    kind = OPAQUE
+                else:
+                    kind = BLEND
+                tile_end = min(tile_x + tile_size, width)
+                if run is not None and run[2] == kind:
+                    run[1] = tile_end
+                    continue
+                if run is not None and run[2] is not None:
+                    self._add_rect(tile_y, tile_size, run, x0, y0, premultiplied, inverse_alpha)
+                run = [tile_x, tile_end, kind]
+            if run is not None and run[2] is not None:
+                self._add_rect(tile_y, tile_size, run, x0, y0, premultiplied, inverse_alpha)
+
+    def _add_rect(self, tile_y: int, tile_size: int, run: List, x0: int, y0: int,
+                  premultiplied: np.ndarray, inverse_alpha: np.ndarray):
+        tile_x0, tile_x1, kind = run
+        tile_y1 = min(tile_y + tile_size, premultiplied.shape[0])
+        self.rects.append((
+            y0 + tile_y, y0 + tile_y1, x0 + tile_x0, x0 + tile_x1, kind,
+            np.ascontiguousarray(premultiplied[tile_y:tile_y1, tile_x0:tile_x1]),
+            None if kind == OPAQUE else np.ascontiguousarray(inverse_alpha[tile_y:tile_y1, tile_x0:tile_x1]),
+        ))
+
+    def draw(self, frame: np.ndarray, t: float):
+        """
+        把图层叠加到画面上（原地修改）
+        :param frame: 画面，uint8
+        :param t: 时间
+        :return:
+        """
+        if t < self.start or (self.end is not None and t >= self.end):
+            return
+
+        for y0, y1, x0, x1, kind, premultiplied, inverse_alpha in self.rects:
+            if kind == OPAQUE:
+                frame[y0:y1, x0:x1] = premultiplied
+            else:
+                # 预乘alpha混合：out = src * a + dst * (1 - a)，src * a已预先算好
+                dst = frame[y0:y1, x0:x1]
+                dst[...] = premultiplied + ((dst * inverse_alpha + 127) // 255).astype(np.uint8)
+
+
+class ClipLayer(object):
+    def __init__(self, clip: VideoClip, x: Union[int, str], y: Union[int, str], canvas_size: Tuple[int, int],
+                 start: float = 0, end: float = None, loop: bool = True, fade_in: float = 0):
+        """
+        动态图层（画面素材、字幕、画中画）：每帧只取图层可见区域，直接写入画布。
+        没有遮罩时直接覆盖，淡入时原地按不透明度混合，有遮罩时只在图层区域内混合。
+        图层位置按每帧画面的实际尺寸计算，字幕这类每帧大小不同的剪辑也适用
+        :param clip: 已缩放到目标尺寸的剪辑
+        :param x: 左上角横坐标，负数表示从右边缘算起，也可以按名称对齐，见get_layer_box
+        :param y: 左上角纵坐标，负数表示从下边缘算起，也可以按名称对齐
+        :param canvas_size: 画布尺寸(width, height)
+        :param start: 开始显示的时间
+        :param end: 结束显示的时间，为空表示一直显示
+        :param loop: 剪辑比画面短时是否循环播放
+        :param fade_in: 淡入时长（转场），为0时不淡入
+        """
+        self.clip = clip
+        self.x = x
+        self.y = y
+        self.canvas_size = canvas_size
+        self.start = start
+        self.end = end
+        self.loop = loop
+        self.fade_in = fade_in
+
+    def draw(self, frame: np.ndarray, t: float):
+        if t < self.start or (self.end is not None and t >= self.end):
+            return
+
+        t = t - self.start
+        if self.loop and self.clip.duration:
+            t = t % self.clip.duration
+        elif self.clip.duration and t >= self.clip.duration:
+            return
+
+        src = self.clip.get_frame(t)
+        height, width = src.shape[:2]
+        origin_x, origin_y, x0, y0, x1, y1 = get_layer_box(self.x, self.y, width, height, self.canvas_size)
+        if x1 <= x0 or y1 <= y0:
+            return
+        crop = (slice(y0 - origin_y, y1 - origin_y), slice(x0 - origin_x, x1 - origin_x))
+
+        dst = frame[y0:y1, x0:x1]
+        src = src[crop]
+        opacity = min(1.0, t / self.fade_in) if self.fade_in > 0 else 1.0
+        if self.clip.mask is None and opacity >= 1:
+            dst[...] = src
+        elif self.clip.mask is None:
+            cv2.addWeighted(src, opacity, dst, 1 - opacity, 0, dst=dst)  # 原地混合，不分配整帧内存
+        else:
+            alpha = (self.clip.mask.get_frame(t)[crop] * (255 * opacity)).astype(np.uint16)[..., None]
+            dst[...] = ((src.astype(np.uint16) * alpha + dst * (255 - alpha) + 127) // 255).astype(np.uint8)
+
+    def close(self):
+        self.clip.close()
+
+
+def render_layers(layers: List, canvas_size: Tuple[int, int], duration: float) -> VideoClip:
+    """
+    把图层依次绘制到黑色画布上，代替moviepy的CompositeVideoClip。
+    画布在两个复用的帧缓冲区之间轮换，每帧不分配整帧内存，所以返回的画面在下一次生成后即失效，
+    只能交给立即复制走画面的使用方（如编码写入）
+    :param layers: StaticLayer或ClipLayer列表，后面的在上层
+    :param canvas_size: 画布尺寸(width, height)
+    :param duration: 时长
+    :return: 新剪辑，不含音频；关闭时归还帧缓冲区
+    """
+    frame_ring = FrameRing(shape=(canvas_size[1], canvas_size[0], 3))
+
+    def make_frame(t):
+        frame = frame_ring.next()
+        frame.fill(0)
+        for layer in layers:
+            layer.draw(frame, t)
+        return frame
+
+    clip = VideoClip(make_frame, duration=duration)
+    clip.close = frame_ring.close
+    return clip
+
+
@@ -0,0 +1,105 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Union
+
+from conf.config import logger
+
+
+class FileCache(object):
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        本地文件缓存，按字节预算进行LRU淘汰
+        :param cache_dir: 缓存文件夹的全路径
+        :param max_bytes: 缓存的最大字节数，超出后淘汰最久未使用的文件
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries: OrderedDict = OrderedDict()  # 缓存键 -> 文件字节数，最久未使用的排在最前面
+        self._total_bytes = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # 程序重启时，按文件的修改时间（即最近使用时间）还原LRU顺序
+        entries = list()
+        for filename in os.listdir(cache_dir):
+            file_path = os.path.join(cache_dir, filename)
+            if filename.endswith(".tmp"):  # 上次异常退出残留的临时文件
+                os.remove(file_path)
+                continue
+            stat = os.stat(file_path)
+            entries.append((stat.st_mtime, filename, stat.st_size))
+        for _, filename, size in sorted(entries):
+            self._entries[filename] = size
+            self._total_bytes += size
+
+        with self._lock:
+            self._evict()
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def get(self, key: str) -> Union[str, None]:
+        """
+        获取缓存文件路径，未命中返回None
+        :param key: 缓存键，即缓存文件名
+        :return:
+        """
+        file_path = os.path.join(self.cache_dir, key)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            os.utime(file_path)  # 刷新修改时间，重启后仍能还原LRU顺序
+        except OSError:  # 文件已被外部删除
+            with self._lock:
+                self._total_bytes -= self._entries.pop(key, 0)
+            return None
+
+        return file_path
+
+    def put(self, key: str, src_path: str, move: bool = False) -> str:
+        """
+        将文件放入缓存
+        :param key: 缓存键，即缓存文件名
+        :param src_path: 源文件路径
+        :param move: 是否移动源文件（默认复制）
+        :return: 缓存文件的全路径
+        """
+        file_path = os.path.join(self.cache_dir, key)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"  # 先写临时文件，防止读到写了一半的文件
+
+        if move:
+            shutil.move(src_path, tmp_path)
+        else:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, file_path)
+        size = os.path.getsize(file_path)
+
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+        return file_path
+
+    def _evict(self):
+        """
+        淘汰最久未使用的文件，直至总字节数不超过预算。最近放入的文件不淘汰。
+        调用方需持有锁
+        :return:
+        """
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, key))
+            except OSError as e:  # windows下文件正在被读取时无法删除，留待下次重启时淘汰
+                logger.warning(f"缓存文件淘汰失败：{key}，{e}")
@@ -0,0 +1,209 @@
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable
+
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+
+from conf.config import config, logger, BASE_DIR
+from utils.media_cache import media_cache
+from utils.persistent_index import PersistentIndex
+
+SAMPLE_RATE = 48000  # K计权滤波器的系数按48kHz给出，解码时统一重采样
+
+# ITU-R BS.1770的K计权滤波器：高频搁架滤波 + 高通滤波，[(b, a), ...]
+K_WEIGHTING_BIQUADS = [
+    ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585]),
+    ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621]),
+]
+
+
+def _get_k_weighting_fir(length: int = 1 << 14) -> np.ndarray:
+    """
+    由两级双二阶滤波器的频率响应得到等效的FIR冲激响应，便于用FFT分块卷积，整段向量化滤波。
+    高通滤波器的冲激响应约几千个采样点后衰减到可忽略，截断误差可忽略
+    :param length: 冲激响应长度
+    :return:
+    """
+    z = np.exp(-1j * np.pi * np.arange(length // 2 + 1) / (length // 2))  # z^-1
+    response = np.ones(length // 2 + 1, dtype=complex)
+    for b, a in K_WEIGHTING_BIQUADS:
+        response *= (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    return np.fft.irfft(response, length)
+
+
+def _get_true_peak_fir(oversample: int = 4, taps_per_phase: int = 12) -> np.ndarray:
+    """
+    真峰值检测的多相插值滤波器（加窗sinc），每一行对应一个相位
+    :param oversample: 过采样倍数
+    :param taps_per_phase: 每个相位的抽头数
+    :return: (oversample, taps_per_phase)
+    """
+    k = np.arange(taps_per_phase) - taps_per_phase // 2
+    window = np.kaiser(taps_per_phase, 8.0)
+    return np.array([np.sinc(k + phase / oversample) * window for phase in range(oversample)])
+
+
+K_WEIGHTING_FIR = _get_k_weighting_fir()
+TRUE_PEAK_FIR = _get_true_peak_fir()
+
+
+def decode_audio(file_path: str) -> np.ndarray:
+    """
+    用ffmpeg把音频一次性解码为numpy数组
+    :param file_path: 音频全路径
+    :return: (2, 采样点数)，float32。单声道文件被ffmpeg以-3dB复制到两个声道，两声道功率相加后与原单声道一致
+    """
+    command = [
+        FFMPEG_BINARY, "-loglevel", "error",
+        "-i", file_path,
+        "-vn", "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "2", "-ar", str(SAMPLE_RATE),
+        "-",
+    ]
+    try:
+        result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"音频解码失败：{file_path}，{e.stderr.decode('utf-8', errors='ignore')}")
+
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, 2).T
+
+
+def k_weighting(samples: np.ndarray, block_size: int = 1 << 18) -> np.ndarray:
+    """
+    K计权滤波，FFT分块重叠相加
+    :param samples: 单声道采样
+    :param block_size: 每块的采样点数
+    :return:
+    """
+    fir_length = len(K_WEIGHTING_FIR)
+    n_fft = block_size + fir_length
+    fir_spectrum = np.fft.rfft(K_WEIGHTING_FIR, n_fft)
+
+    filtered = np.zeros(len(samples) + fir_length - 1)
+    for start in range(0, len(samples), block_size):
+        block = samples[start:start + block_size].astype(np.float64)
+        out = np.fft.irfft(np.fft.rfft(block, n_fft) * fir_spectrum, n_fft)[:len(block) + fir_length - 1]
+        filtered[start:start + len(out)] += out
+
+    return filtered[:len(samples)]
+
+
+def integrated_loudness(channels: np.ndarray) -> float:
+    """
+    计算综合响度（LUFS），400ms分块、75%重叠，先绝对门限-70LUFS、再相对门限-10LU
+    :param channels: (声道数, 采样点数)
+    :return: 全静音时返回-70
+    """
+    block = int(0.4 * SAMPLE_RATE)
+    hop = int(0.1 * SAMPLE_RATE)
+    if channels.shape[1] < block:
+        return -70.0
+
+    starts = np.arange(0, channels.shape[1] - block + 1, hop)
+    powers = np.zeros(len(starts))
+    for channel in channels:  # 左右声道权重均为1
+        filtered = k_weighting(channel)
+        cumsum = np.concatenate(([0.0], np.cumsum(filtered * filtered)))
+        powers += (cumsum[starts + block] - cumsum[starts]) / block
+
+    with np.errstate(divide="ignore"):
+        block_loudness = -0.691 + 10 * np.log10(powers)
+
+    gated = powers[block_loudness > -70]
+    if len(gated) == 0:
+        return -70.0
+
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = powers[(block_loudness > -70) & (block_loudness > relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def true_peak(channels: np.ndarray) -> float:
+    """
+    计算真峰值（dBTP）：4倍过采样后的最大绝对值
+    :param channels: (声道数, 采样点数)
+    :return: 全静音时返回-inf
+    """
+    peak = 0.0
+    for channel in channels:
+        for phase_fir in TRUE_PEAK_FIR:
+            peak = max(peak, float(np.abs(np.convolve(channel, phase_fir.astype(np.float32))).max(initial=0.0)))
+
+    with np.errstate(divide="ignore"):
+        return float(20 * np.log10(peak))
+
+
+def analyze_loudness(file_path: str) -> Dict:
+    """
+    分析音频的综合响度和真峰值，供进程池调用
+    :param file_path: 音频全路径
+    :return: 例：{"lufs": -18.2, "true_peak": -0.8}
+    """
+    channels = decode_audio(file_path)
+    return {"lufs": round(integrated_loudness(channels), 2), "true_peak": round(true_peak(channels), 2)}
+
+
+class LoudnessIndex(PersistentIndex):
+    version = 2  # 单声道音频此前少算了3LU
+
+    def __init__(self, index_path: str, workers: int = 4):
+        """
+        音频响度索引：每个音频只解码分析一次，结果按文件指纹持久化，混音时直接按索引计算增益
+        :param index_path: 索引文件路径，.json文件
+        :param workers: 批量分析的进程数
+        """
+        super().__init__(index_path)
+        self.workers = workers
+
+    def get(self, file_path: str) -> Dict:
+        """
+        获取音频的响度，未分析过时从本地副本分析并立即写入索引文件，之后的进程不再重复分析
+        :param file_path: 音频全路径
+        :return: 例：{"lufs": -18.2, "true_peak": -0.8}
+        """
+        fingerprint = self._fingerprint(file_path)
+        entry = self._get_cached(file_path, fingerprint)
+        if entry is None:
+            entry = self._put(file_path, fingerprint, analyze_loudness(media_cache.get_local_path(file_path)))
+            logger.info(f"音频响度已分析：{file_path}，{entry['lufs']}LUFS，{entry['true_peak']}dBTP")
+            self.save()
+        return entry
+
+    def analyze_all(self, file_paths: Iterable[str]):
+        """
+        用进程池批量分析尚未分析过的音频，并写入索引文件
+        :param file_paths: 音频全路径列表
+        :return:
+        """
+        pending = dict()
+        for file_path in file_paths:
+            fingerprint = self._fingerprint(file_path)
+            if self._get_cached(file_path, fingerprint) is None:
+                pending[file_path] = fingerprint
+        logger.info(f"待分析响度的音频数：{len(pending)}")
+
+        local_paths = [media_cache.get_local_path(file_path) for file_path in pending]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for file_path, entry in zip(pending, executor.map(analyze_loudness, local_paths)):
+                self._put(file_path, pending[file_path], entry)
+                logger.info(f"音频响度已分析：{file_path}，{entry['lufs']}LUFS，{entry['true_peak']}dBTP")
+
+        self.save()
+
+    def get_gain(self, file_path: str, target_lufs: float, true_peak_limit: float) -> float:
+        """
+        计算把音频调整到目标响度所需的增益，且增益后真峰值不超过上限
+        :param file_path: 音频全路径
+        :param target_lufs: 目标响度（LUFS）
+        :param true_peak_limit: 真峰值上限（dBTP）
+        :return: 增益（dB），全静音的音频不调整
+        """
+        entry = self.get(file_path)
+        if entry["lufs"] <= -70:
+            return 0.0
+        return min(target_lufs - entry["lufs"], true_peak_limit - entry["true_peak"])
+
+
+loudness_index = LoudnessIndex(index_path=os.path.join(BASE_DIR, config["loudness"]["index_file"]),
+                               workers=config["loudness"]["workers"])
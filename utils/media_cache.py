@@ -0,0 +1,184 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Iterable, Union
+
+from conf.config import config, logger, BASE_DIR
+from utils.file_cache import FileCache
+
+
+class MediaCache(object):
+    def __init__(self, cache_dir: str, max_bytes: int, prefetch_workers: int = 4, enable: bool = True):
+        """
+        远程媒体素材（如SMB共享目录）的本地读穿缓存
+        读取素材时优先读本地缓存，未命中时从远程复制到本地后再读；并支持在后台预取后续任务要用到的素材
+        :param cache_dir: 本地缓存文件夹
+        :param max_bytes: 缓存的最大字节数
+        :param prefetch_workers: 后台预取的线程数
+        :param enable: 是否启用缓存，不启用时直接读远程路径
+        """
+        self.enable = enable
+
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = dict()  # 正在复制的素材，避免同一文件被重复复制
+        self._listdir_cache: Dict[str, List[str]] = dict()
+        self._stat_cache: Dict[str, os.stat_result] = dict()
+
+        if enable:
+            self._file_cache = FileCache(cache_dir=cache_dir, max_bytes=max_bytes)
+            self._executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="media_prefetch")
+
+    def stat(self, file_path: str) -> os.stat_result:
+        """
+        获取远程文件的大小和修改时间，结果在进程内缓存：本地缓存、素材索引和渲染配方都要用到文件指纹，
+        同一文件每次运行只访问一次远程共享目录
+        :param file_path: 远程文件路径
+        :return:
+        """
+        with self._lock:
+            stat = self._stat_cache.get(file_path)
+        if stat is None:
+            stat = os.stat(file_path)
+            with self._lock:
+                self._stat_cache[file_path] = stat
+
+        return stat
+
+    def _cache_key(self, file_path: str) -> str:
+        """
+        缓存键由远程路径、文件大小和修改时间决定，远程文件被替换后自动失效
+        :param file_path: 远程文件路径
+        :return:
+        """
+        stat = self.stat(file_path)
+        digest = hashlib.sha1(f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+        return f"{digest}{os.path.splitext(file_path)[-1].lower()}"
+
+    def listdir(self, dir_path: str) -> List[str]:
+        """
+        列出文件夹下的素材全路径（已过滤隐藏文件和Thumbs.db，按文件名排序，随机选取的结果不受文件系统顺序影响），结果在进程内缓存
+        :param dir_path: 文件夹路径
+        :return:
+        """
+        with self._lock:
+            file_paths = self._listdir_cache.get(dir_path)
+        if file_paths is None:
+            file_paths = [os.path.join(dir_path, filename) for filename in sorted(os.listdir(dir_path))
+                          if not filename.startswith(('.', 'Thumbs.db'))]
+            with self._lock:
+                self._listdir_cache[dir_path] = file_paths
+
+        return list(file_paths)
+
+    def clear_listdir_cache(self):
+        """
+        清空文件夹列表和文件状态的缓存，远程文件夹有新增或替换的素材时调用
+        :return:
+        """
+        with self._lock:
+            self._listdir_cache.clear()
+            self._stat_cache.clear()
+
+    def get_local_path(self, file_path: str) -> str:
+        """
+        获取素材的本地路径，缓存未命中时阻塞复制到本地
+        :param file_path: 远程文件路径
+        :return:
+        """
+        if not self.enable:
+            return file_path
+
+        key = self._cache_key(file_path)
+        local_path = self._file_cache.get(key)
+        if local_path:
+            return local_path
+
+        with self._lock:
+            future = self._pending.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self._pending[key] = future
+
+        if is_owner:
+            try:
+                future.set_result(self._file_cache.put(key, file_path))
+                logger.info(f"素材已缓存至本地：{file_path}")
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+
+        return future.result()
+
+    def get_cached_path(self, file_path: str) -> Union[str, None]:
+        """
+        获取素材已有的本地副本，未缓存时不复制
+        :param file_path: 远程文件路径
+        :return: 本地路径；未缓存时返回None，未启用缓存时返回远程路径
+        """
+        if not self.enable:
+            return file_path
+
+        return self._file_cache.get(self._cache_key(file_path))
+
+    def prefetch(self, file_paths: Iterable[str], on_cached: Callable[[str], None] = None):
+        """
+        后台预取素材，不阻塞调用方
+        :param file_paths: 远程文件路径列表
+        :param on_cached: 素材复制到本地后在预取线程中调用，参数为远程文件路径，例如顺带建立素材索引
+        :return:
+        """
+        if not self.enable:
+            return
+
+        for file_path in file_paths:
+            self._executor.submit(self._prefetch_one, file_path, on_cached)
+
+    def prefetch_dirs(self, dir_paths: Iterable[str], on_cached: Callable[[str], None] = None):
+        """
+        后台预取文件夹下的所有素材
+        :param dir_paths: 远程文件夹路径列表
+        :param on_cached: 见prefetch
+        :return:
+        """
+        if not self.enable:
+            return
+
+        for dir_path in dir_paths:
+            self._executor.submit(lambda path: self.prefetch(self.listdir(path), on_cached), dir_path)
+
+    def _prefetch_one(self, file_path: str, on_cached: Callable[[str], None] = None):
+        try:
+            self.get_local_path(file_path)
+            if on_cached is not None:
+                on_cached(file_path)
+        except Exception as e:
+            logger.warning(f"素材预取失败：{file_path}，{e}")
+
+
+def get_script_media_dirs(rows: List) -> List[str]:
+    """
+    获取视频脚本引用的所有素材文件夹（画面素材、封面、BGM）
+    :param rows: 视频脚本的内容，[[字幕, 素材文件夹, 封面文件夹, BGM文件夹], ...]
+    :return:
+    """
+
+    dir_names = [row[1] for row in rows] + [rows[0][2], rows[0][3]]
+    dir_paths = list()
+    for dir_name in dir_names:
+        dir_path = os.path.join(config["compose_params"]["media_root_path"], dir_name)
+        if dir_path not in dir_paths:
+            dir_paths.append(dir_path)
+
+    return dir_paths
+
+
+media_cache = MediaCache(
+    cache_dir=os.path.join(BASE_DIR, config["media_cache"]["cache_dir"]),
+    max_bytes=int(config["media_cache"]["max_size_gb"] * 1024 ** 3),
+    prefetch_workers=config["media_cache"]["prefetch_workers"],
+    enable=config["media_cache"]["enable"]
+)
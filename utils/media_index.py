@@ -0,0 +1,400 @@
+import bisect
+import os
+import random
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Iterable, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.VideoFileClip import VideoFileClip
+
+from conf.config import config, logger, BASE_DIR
+from utils.media_cache import media_cache
+from utils.persistent_index import PersistentIndex
+
+
+def dhash(gray: np.ndarray) -> int:
+    """
+    计算灰度图的差异哈希（dHash），内容相近的画面哈希值的汉明距离小
+    :param gray: 灰度图
+    :return: 64位哈希值
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    return bin(hash1 ^ hash2).count("1")
+
+
+def detect_shot_boundaries(file_path: str, sample_fps: float = 4, threshold: float = 0.4) -> List[float]:
+    """
+    检测视频的镜头切换点：由ffmpeg按采样帧率抽帧并缩小到64x36后一次性输出，比较相邻采样帧的颜色直方图。
+    未采样的帧不做颜色转换和缩放，也不经管道传输
+    :param file_path: 视频路径
+    :param sample_fps: 每秒采样几帧
+    :param threshold: 巴氏距离阈值，超过该值视为镜头切换
+    :return: 镜头切换的时间点（秒），升序
+    """
+    width, height = 64, 36
+    command = [
+        FFMPEG_BINARY, "-loglevel", "error",
+        "-i", file_path,
+        "-an", "-vf", f"fps={sample_fps},scale={width}:{height}", "-f", "rawvideo", "-pix_fmt", "bgr24",
+        "-",
+    ]
+    try:
+        result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"视频解码失败：{file_path}，{e.stderr.decode('utf-8', errors='ignore')}")
+    frames = np.frombuffer(result.stdout, dtype=np.uint8).reshape(-1, height, width, 3)
+
+    boundaries = list()
+    prev_hist = None
+    for index, frame in enumerate(frames):
+        hist = cv2.calcHist([cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)], [0, 1], None, [16, 16], [0, 180, 0, 256])
+        cv2.normalize(hist, hist)
+        if prev_hist is not None and cv2.compareHist(prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA) > threshold:
+            boundaries.append(round(index / sample_fps, 3))
+        prev_hist = hist
+
+    return boundaries
+
+
+def get_file_type(file_path: str) -> str:
+    """
+    获取文件类型
+    :param file_path:文件全路径
+    :return:
+    """
+    image_extensions = ['.jpg', '.jpeg', '.png', '.gif']
+    video_extensions = ['.mp4', '.avi', '.mov']
+
+    file_extension = os.path.splitext(file_path)[-1].lower()
+
+    if file_extension in image_extensions:
+        return 'image'
+    elif file_extension in video_extensions:
+        return 'video'
+    else:
+        return 'unknown'
+
+
+class MediaIndex(PersistentIndex):
+    def __init__(self, index_path: str, video_keyframes: int = 3, shot_sample_fps: float = 4, shot_threshold: float = 0.4,
+                 workers: int = 4):
+        """
+        素材元数据索引：宽高、时长、感知哈希（图片一个，视频每个采样关键帧一个）和视频的镜头切换点。
+        每个素材只分析一次，结果按文件指纹持久化，远程文件被替换后自动重新分析。
+        宽高、时长和感知哈希只需读取文件头和几个关键帧，在预取素材时顺带分析；
+        镜头切换点需要解码整个视频，不在合成时分析，由build_all单独批量建立，未建立时切割点不对齐
+        :param index_path: 索引文件路径，.json文件
+        :param video_keyframes: 视频采样的关键帧数
+        :param shot_sample_fps: 检测镜头切换时每秒采样几帧
+        :param shot_threshold: 镜头切换的直方图距离阈值
+        :param workers: 批量检测镜头切换的进程数
+        """
+        super().__init__(index_path)
+        self.video_keyframes = video_keyframes
+        self.shot_sample_fps = shot_sample_fps
+        self.shot_threshold = shot_threshold
+        self.workers = workers
+
+    def get(self, file_path: str) -> Dict:
+        """
+        获取素材的元数据，未分析过时先分析宽高、时长和感知哈希
+        :param file_path: 素材路径
+        :return: 例：{"width": 1080, "height": 1920, "duration": 12.5, "hashes": ["f0e1...", ...], "shots": [3.2, 7.84]}，
+                 图片的duration为None；未批量建立镜头切换点时没有shots
+        """
+        fingerprint = self._fingerprint(file_path)
+        entry = self._get_cached(file_path, fingerprint)
+        if entry is None:
+            entry = self._put(file_path, fingerprint, self._analyze(file_path))
+        return entry
+
+    def get_hashes(self, file_path: str) -> List[int]:
+        return [int(h, 16) for h in self.get(file_path)["hashes"]]
+
+    def is_vertical(self, file_path: str) -> bool:
+        entry = self.get(file_path)
+        return entry["height"] > entry["width"]
+
+    def snap_cut_point(self, file_path: str, t: float, tolerance: float) -> float:
+        """
+        把视频的切割点向后对齐到最近的镜头切换点，使下一段画面从新镜头开始，不从镜头中间切入
+        :param file_path: 视频路径
+        :param t: 切割点（秒）
+        :param tolerance: 最多向后移动几秒，范围内没有镜头切换时不移动
+        :return: 对齐后的切割点
+        """
+        if t <= 0 or tolerance <= 0:
+            return t
+
+        shots = self.get(file_path).get("shots", [])
+        i = bisect.bisect_left(shots, t)
+        if i < len(shots) and shots[i] - t <= tolerance:
+            return shots[i]
+        return t
+
+    def prefetch_hook(self, file_path: str):
+        """
+        预取素材到本地后调用，在预取线程中分析画面素材，规划时直接查索引
+        :param file_path: 素材路径
+        :return:
+        """
+        if get_file_type(file_path) in ("image", "video"):
+            self.get(file_path)
+
+    def _analyze(self, file_path: str) -> Dict:
+        media_type = get_file_type(file_path)
+        # 已预取到本地时读本地副本；否则直接读远程文件的文件头和几个关键帧，不为了建立索引复制整个文件，
+        # 试运行时也不会把所有素材都复制到本地缓存
+        local_path = media_cache.get_cached_path(file_path) or file_path
+        if media_type == "image":
+            with Image.open(local_path) as img:
+                width, height = img.size
+                hashes = [dhash(np.asarray(img.convert("L")))]
+            duration = None
+        elif media_type == "video":
+            video_clip = VideoFileClip(local_path)  # 时长与渲染时moviepy读到的保持一致
+            try:
+                duration = video_clip.duration
+            finally:
+                video_clip.close()
+
+            cap = cv2.VideoCapture(local_path)
+            try:
+                width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                hashes = list()
+                for i in range(self.video_keyframes):
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_count * (i + 0.5) / self.video_keyframes))
+                    ok, frame = cap.read()
+                    if ok:
+                        hashes.append(dhash(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+            finally:
+                cap.release()
+        else:
+            raise ValueError(f"不支持该类型的媒体文件：{file_path}")
+
+        logger.info(f"素材已建立索引：{file_path}")
+        return {"width": width, "height": height, "duration": duration, "hashes": [f"{h:016x}" for h in hashes]}
+
+    def build_all(self, file_paths: Iterable[str]):
+        """
+        批量建立素材索引：分析尚未分析过的素材，并用进程池从本地副本检测视频的镜头切换点，写入索引文件
+        :param file_paths: 素材路径列表，非画面素材会被忽略
+        :return:
+        """
+        pending = list()
+        for file_path in file_paths:
+            media_type = get_file_type(file_path)
+            if media_type not in ("image", "video"):
+                continue
+            entry = self.get(file_path)
+            if media_type == "video" and "shots" not in entry:
+                pending.append(file_path)
+        logger.info(f"待检测镜头切换的视频数：{len(pending)}")
+
+        local_paths = [media_cache.get_local_path(file_path) for file_path in pending]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for file_path, shots in zip(pending, executor.map(detect_shot_boundaries, local_paths,
+                                                              repeat(self.shot_sample_fps), repeat(self.shot_threshold))):
+                with self._lock:
+                    self._entries[file_path]["shots"] = shots
+                    self._dirty = True
+                logger.info(f"视频镜头切换点已检测：{file_path}，共{len(shots)}个")
+
+        self.save()
+
+
+class MediaPool(object):
+    def __init__(self, file_paths: Iterable[str] = ()):
+        """
+        待选素材池，支持O(1)的随机抽取和删除（不放回抽样）
+        :param file_paths: 素材路径
+        """
+        self._items: List[str] = list()
+        self._positions: Dict[str, int] = dict()
+        for file_path in file_paths:
+            if file_path not in self._positions:
+                self._positions[file_path] = len(self._items)
+                self._items.append(file_path)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, index: int) -> str:
+        return self._items[index]
+
+    def __contains__(self, file_path: str) -> bool:
+        return file_path in self._positions
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __repr__(self):
+        return f"MediaPool({self._items!r})"
+
+    def remove(self, file_path: str):
+        """
+        删除素材：与末尾元素交换后弹出
+        :param file_path: 素材路径
+        :return:
+        """
+        index = self._positions.pop(file_path)
+        last = self._items.pop()
+        if index < len(self._items):
+            self._items[index] = last
+            self._positions[last] = index
+
+    def choice(self, rng: random.Random = random, guard: 'SimilarityGuard' = None,
+               max_attempts: int = 8) -> str:
+        """
+        随机选取一个素材，尽量避开与已用素材相似的
+        :param rng: 随机数生成器
+        :param guard: 相似度守卫，为空时不判断相似
+        :param max_attempts: 最多尝试次数，都相似时退而选取最后一次抽到的素材
+        :return:
+        """
+        file_path = None
+        for _ in range(max_attempts):
+            file_path = self._items[rng.randrange(len(self._items))]
+            if guard is None or not guard.is_similar(file_path):
+                break
+            logger.info(f"素材与已用素材相似，重新选取：{file_path}")
+
+        return file_path
+
+
+class SimilarityGuard(object):
+    def __init__(self, media_index: MediaIndex, threshold: int, history: Iterable[Iterable[str]] = ()):
+        """
+        相似度守卫：记录已用素材的感知哈希，判断候选素材是否与其近似重复
+        :param media_index: 素材索引
+        :param threshold: 汉明距离阈值，不超过该值视为近似重复
+        :param history: 同一脚本之前几个视频用过的素材，跨视频去重
+        """
+        self.media_index = media_index
+        self.threshold = threshold
+
+        self.used_paths: List[str] = list()
+        self._used_hashes: Dict[str, List[int]] = dict()
+        for file_paths in history:
+            for file_path in file_paths:
+                self._add_hashes(file_path)
+
+    def _add_hashes(self, file_path: str):
+        if file_path not in self._used_hashes:
+            self._used_hashes[file_path] = self.media_index.get_hashes(file_path)
+
+    def add(self, file_path: str):
+        self.used_paths.append(file_path)
+        self._add_hashes(file_path)
+
+    def is_similar(self, file_path: str) -> bool:
+        """
+        判断素材是否与已用素材近似重复。视频从上次的切割点继续使用，同一视频分段使用不算重复；
+        同一张图片再次出现则算重复
+        :param file_path: 候选素材路径
+        :return:
+        """
+        is_video = get_file_type(file_path) == "video"
+        hashes = self.media_index.get_hashes(file_path)
+        for used_path, used_hashes in self._used_hashes.items():
+            if is_video and used_path == file_path:
+                continue
+            for h1 in hashes:
+                for h2 in used_hashes:
+                    if hamming_distance(h1, h2) <= self.threshold:
+                        return True
+        return False
+
+
+class SimilarityHistory(object):
+    def __init__(self, window: int):
+        """
+        记录每个脚本最近几个视频用过的素材，供跨视频去重
+        :param window: 记录最近几个视频
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._history: Dict[str, deque] = dict()
+        self._transient = set()  # 不持久化的记录，见add
+
+    def get(self, script_key: str) -> List[List[str]]:
+        with self._lock:
+            return list(self._history.get(script_key, []))
+
+    def add(self, script_key: str, file_paths: List[str], persistent: bool = True):
+        """
+        记录一个视频用过的素材
+        :param script_key: 见get_script_key
+        :param file_paths: 素材路径列表
+        :param persistent: 是否持久化。常驻服务的作业不会重跑，其记录只在作业进行期间有效，结束后由remove删除
+        :return:
+        """
+        with self._lock:
+            self._history.setdefault(script_key, deque(maxlen=self.window)).append(list(file_paths))
+            if not persistent:
+                self._transient.add(script_key)
+
+    def remove(self, script_key: str):
+        with self._lock:
+            self._history.pop(script_key, None)
+            self._transient.discard(script_key)
+
+    def to_dict(self) -> Dict[str, List[List[str]]]:
+        """
+        导出记录，随素材使用情况一起持久化，程序重启后相似度判断与重启前一致
+        :return: {脚本: [各视频用过的素材]}，不含不持久化的记录
+        """
+        with self._lock:
+            return {script_key: [list(file_paths) for file_paths in history]
+                    for script_key, history in self._history.items() if script_key not in self._transient}
+
+    def load(self, data: Dict[str, List[List[str]]]):
+        """
+        用导出的记录替换当前记录
+        :param data: to_dict的结果
+        :return:
+        """
+        with self._lock:
+            self._history = {script_key: deque(history, maxlen=self.window) for script_key, history in data.items()}
+            self._transient = set()
+
+
+def get_script_key(task: Dict) -> str:
+    """
+    获取任务在跨视频去重记录中的键：同一视频脚本的视频之间互相去重；
+    常驻服务的作业只在作业内的视频之间去重，记录不持久化，作业结束后删除
+    :param task: 任务
+    :return:
+    """
+    return task.get("job_id") or task.get("video_script_path") or task["task_name"]
+
+
+def to_media_pool(medias: Union[List[str], MediaPool]) -> MediaPool:
+    """
+    兼容旧持久化文件中以列表保存的素材
+    :param medias: 素材列表或素材池
+    :return:
+    """
+    return medias if isinstance(medias, MediaPool) else MediaPool(medias)
+
+
+media_index = MediaIndex(index_path=os.path.join(BASE_DIR, config["media_index"]["index_file"]),
+                         video_keyframes=config["media_index"]["video_keyframes"],
+                         shot_sample_fps=config["media_index"]["shot_sample_fps"],
+                         shot_threshold=config["media_index"]["shot_threshold"],
+                         workers=config["media_index"]["workers"])
+similarity_history = SimilarityHistory(window=config["media_index"]["variant_window"])
@@ -0,0 +1,127 @@
+import gc
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+import psutil
+
+from conf.config import config, logger
+
+
+def get_rss() -> int:
+    """
+    获取本进程及其子进程（ffmpeg、ImageMagick等）的常驻内存之和
+    :return: 字节数
+    """
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:  # 子进程已退出
+            pass
+    return rss
+
+
+class FramePool(object):
+    def __init__(self, max_buffers_per_shape: int = 8):
+        """
+        帧缓冲区池，按形状复用numpy数组，避免每帧都重新分配整帧内存
+        :param max_buffers_per_shape: 每种形状最多缓存几个空闲缓冲区
+        """
+        self.max_buffers_per_shape = max_buffers_per_shape
+        self._lock = threading.Lock()
+        self._free: Dict[Tuple, List[np.ndarray]] = dict()
+
+    def acquire(self, shape: Tuple, dtype=np.uint8) -> np.ndarray:
+        """
+        取一个缓冲区，内容未初始化
+        :param shape: 形状，例：(1920, 1080, 3)
+        :param dtype: 数据类型
+        :return:
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            buffers = self._free.get(key)
+            if buffers:
+                return buffers.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, buffer: np.ndarray):
+        """
+        归还缓冲区
+        :param buffer: 由acquire取得的缓冲区
+        :return:
+        """
+        key = (buffer.shape, buffer.dtype.str)
+        with self._lock:
+            buffers = self._free.setdefault(key, list())
+            if len(buffers) < self.max_buffers_per_shape:
+                buffers.append(buffer)
+
+
+class FrameRing(object):
+    def __init__(self, shape: Tuple, size: int = 2, dtype=np.uint8, pool: FramePool = None):
+        """
+        环形帧缓冲：剪辑每生成一帧就轮换到下一个缓冲区，所以返回的画面只在之后size-1次生成内有效。
+        适用于画面会被立即合成（复制）走的剪辑
+        :param shape: 帧的形状
+        :param size: 缓冲区个数
+        :param dtype: 数据类型
+        :param pool: 帧缓冲区池
+        """
+        self.pool = pool or frame_pool
+        self._buffers = [self.pool.acquire(shape, dtype) for _ in range(size)]
+        self._index = 0
+
+    def next(self) -> np.ndarray:
+        buffer = self._buffers[self._index]
+        self._index = (self._index + 1) % len(self._buffers)
+        return buffer
+
+    def close(self):
+        for buffer in self._buffers:
+            self.pool.release(buffer)
+        self._buffers = list()
+
+
+class MemoryGuard(object):
+    def __init__(self, max_rss_bytes: int, check_interval: float = 1.0):
+        """
+        内存上限守卫：内存超过上限时，新的渲染等待已有渲染结束后再开始，以降低并发代替内存溢出。
+        至少允许一个渲染运行，避免死锁
+        :param max_rss_bytes: 内存上限（字节），为0时不限制
+        :param check_interval: 等待时检查内存的间隔（秒）
+        """
+        self.max_rss_bytes = max_rss_bytes
+        self.check_interval = check_interval
+        self._condition = threading.Condition()
+        self._active = 0
+
+    def acquire(self):
+        with self._condition:
+            if self.max_rss_bytes:
+                warned = False
+                while self._active > 0 and get_rss() > self.max_rss_bytes:
+                    if not warned:
+                        logger.warning(f"内存超过上限{self.max_rss_bytes / 1024 ** 3:.1f}GB，等待其他渲染结束，当前并发：{self._active}")
+                        warned = True
+                        gc.collect()
+                    self._condition.wait(timeout=self.check_interval)
+            self._active += 1
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+frame_pool = FramePool(max_buffers_per_shape=config["memory"]["frame_buffers_per_shape"])
+memory_guard = MemoryGuard(max_rss_bytes=int(config["memory"]["max_rss_gb"] * 1024 ** 3))
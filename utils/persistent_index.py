@@ -0,0 +1,63 @@
+import json
+import os
+import threading
+from typing import Dict, Union
+
+from utils.media_cache import media_cache
+
+
+class PersistentIndex(object):
+    version = None  # 分析方法改变、旧结果不再准确时由子类递增，旧条目自动重新分析
+
+    def __init__(self, index_path: str):
+        """
+        按文件指纹持久化的分析结果索引：每个文件只分析一次，文件被替换后（大小或修改时间变化）自动失效
+        :param index_path: 索引文件路径，.json文件
+        """
+        self.index_path = index_path
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = dict()
+        self._dirty = False
+
+        if os.path.exists(index_path):
+            with open(index_path, mode='r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+
+    @staticmethod
+    def _fingerprint(file_path: str) -> str:
+        stat = media_cache.stat(file_path)
+        return f"{stat.st_size}|{stat.st_mtime_ns}"
+
+    def _get_cached(self, file_path: str, fingerprint: str) -> Union[Dict, None]:
+        with self._lock:
+            entry = self._entries.get(file_path)
+        if entry is not None and entry["fingerprint"] == fingerprint and entry.get("version") == self.version:
+            return entry
+        return None
+
+    def _put(self, file_path: str, fingerprint: str, entry: Dict) -> Dict:
+        entry["fingerprint"] = fingerprint
+        if self.version is not None:
+            entry["version"] = self.version
+        with self._lock:
+            self._entries[file_path] = entry
+            self._dirty = True
+        return entry
+
+    def save(self):
+        """
+        有新分析的文件时写入索引文件
+        :return:
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            entries_str = json.dumps(self._entries, ensure_ascii=False)
+            self._dirty = False
+
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, mode='w', encoding='utf-8') as f:
+            f.write(entries_str)
+        os.replace(tmp_path, self.index_path)
@@ -0,0 +1,202 @@
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Any
+
+from conf.config import logger
+
+
+_END = object()  # 阶段结束的哨兵
+
+
+class PipelineStopped(Exception):
+    """流水线中某个阶段出错后，其他阶段的线程据此退出"""
+
+
+class Stage(object):
+    def __init__(self, name: str, func: Callable[[Any], Iterable], workers: int = 1, queue_size: int = 2,
+                 ordered: bool = False):
+        """
+        流水线的一个阶段
+        :param name: 阶段名称
+        :param func: 处理函数，接收一个上游产物，返回交给下游的产物列表（可以为空，用于扇入；也可以有多个，用于扇出）
+        :param workers: 该阶段的工作线程数
+        :param queue_size: 该阶段输入队列的容量，队列满时上游阻塞（背压），以此限制内存占用
+        :param ordered: 是否按输入顺序交给下游。多线程阶段处理完的先后不固定，下游依赖顺序时（如消耗全局状态）需开启
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ordered = ordered
+
+
+class Pipeline(object):
+    def __init__(self, stages: List[Stage], error_handler: Callable[[Stage, Any, Exception], None] = None,
+                 monitor: Callable[[Stage, float, Any], None] = None):
+        """
+        分阶段流水线，阶段之间用有界队列连接，各阶段并行运行。
+        整体吞吐量受限于最慢的阶段，而不是所有阶段耗时之和
+        :param stages: 按先后顺序排列的阶段
+        :param error_handler: 出错处理函数，接收(阶段, 产物, 异常)。为空时任一阶段出错即停止整个流水线；
+                              不为空时只丢弃出错的产物，流水线继续运行
+        :param monitor: 耗时统计函数，每处理完一个产物调用一次，接收(阶段, 耗时秒数, 产物)
+        """
+        self.stages = stages
+        self.error_handler = error_handler
+        self.monitor = monitor
+
+        self._stop = threading.Event()
+        self._error: BaseException = None
+        self._queues: List[queue.Queue] = list()
+
+    def _put(self, q: queue.Queue, item):
+        while True:
+            if self._stop.is_set():  # 队列未满时也要检查，否则出错后仍会处理完剩余的全部产物
+                raise PipelineStopped()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    raise PipelineStopped()
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self._stop.is_set():
+                raise PipelineStopped()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise PipelineStopped()
+
+    def _fail(self, e: BaseException):
+        if self._error is None:
+            self._error = e
+        self._stop.set()
+
+    def _feed(self, items: Iterable, output: queue.Queue, workers: int):
+        try:
+            for item in items:
+                self._put(output, item)
+            for _ in range(workers):
+                self._put(output, _END)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            self._fail(e)
+
+    def _wait_turn(self, order: Dict, ticket: int):
+        with order["condition"]:
+            while order["next"] != ticket:
+                if self._stop.is_set():
+                    raise PipelineStopped()
+                order["condition"].wait(timeout=0.1)
+
+    @staticmethod
+    def _finish_turn(order: Dict, ticket: int):
+        with order["condition"]:
+            order["done"].add(ticket)
+            while order["next"] in order["done"]:
+                order["done"].remove(order["next"])
+                order["next"] += 1
+            order["condition"].notify_all()
+
+    def _work(self, stage: Stage, input_: queue.Queue, output: queue.Queue, next_workers: int,
+              alive: List[int], alive_lock: threading.Lock, order: Dict):
+        try:
+            while True:
+                if stage.ordered:  # 取产物和领号要原子地进行，号码顺序才与输入顺序一致
+                    with order["lock"]:
+                        item = self._get(input_)
+                        ticket = order["tickets"]
+                        order["tickets"] += 1
+                else:
+                    item = self._get(input_)
+                    ticket = None
+                if item is _END:
+                    if ticket is not None:
+                        self._finish_turn(order, ticket)
+                    break
+                try:
+                    try:
+                        started_at = time.time()
+                        results = stage.func(item) or []
+                        if self.monitor is not None:
+                            self.monitor(stage, time.time() - started_at, item)
+                    except Exception as e:
+                        if self.error_handler is None:
+                            raise
+                        logger.exception(f"流水线阶段[{stage.name}]出错，丢弃该产物：{e}")
+                        self.error_handler(stage, item, e)
+                        continue
+                    if ticket is not None:  # 等排在前面的产物都交给下游后再交出
+                        self._wait_turn(order, ticket)
+                    for result in results:
+                        self._put(output, result)
+                finally:
+                    if ticket is not None:
+                        self._finish_turn(order, ticket)
+
+            # 本阶段最后一个退出的线程负责通知下游结束
+            with alive_lock:
+                alive[0] -= 1
+                is_last = alive[0] == 0
+            if is_last:
+                for _ in range(next_workers):
+                    self._put(output, _END)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            logger.exception(f"流水线阶段[{stage.name}]出错：{e}")
+            self._fail(e)
+
+    def get_queue_sizes(self) -> Dict[str, int]:
+        """
+        获取各阶段输入队列中等待的产物数，某阶段前持续积压说明它是瓶颈
+        :return: {阶段名称: 等待数}
+        """
+        return {stage.name: q.qsize() for stage, q in zip(self.stages, self._queues)}
+
+    def run(self, items: Iterable) -> Iterator:
+        """
+        运行流水线
+        :param items: 第一个阶段的输入
+        :return: 逐个产出最后一个阶段的产物
+        """
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        self._queues = queues
+        output = queue.Queue()
+
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], self.stages[0].workers), daemon=True)]
+        for index, stage in enumerate(self.stages):
+            is_last_stage = index == len(self.stages) - 1
+            next_queue = output if is_last_stage else queues[index + 1]
+            next_workers = 1 if is_last_stage else self.stages[index + 1].workers
+            alive, alive_lock = [stage.workers], threading.Lock()
+            order = {"lock": threading.Lock(), "condition": threading.Condition(), "tickets": 0, "next": 0, "done": set()}
+            for i in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, queues[index], next_queue, next_workers, alive, alive_lock, order),
+                    name=f"{stage.name}-{i+1}", daemon=True))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                try:
+                    result = self._get(output)
+                except PipelineStopped:
+                    break
+                if result is _END:
+                    break
+                yield result
+        finally:
+            self._stop.set()
+            for thread in threads[1:]:  # 输入可能是阻塞的生成器（如常驻服务的任务队列），不等待输入线程
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
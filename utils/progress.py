@@ -0,0 +1,183 @@
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, Union
+
+from conf.config import config, logger, BASE_DIR
+from utils.pipeline import Pipeline, Stage
+
+
+class BatchProgress(object):
+    def __init__(self, status_path: str, total_videos: int = 0, window: float = 600, interval: float = 5,
+                 console: bool = False):
+        """
+        整批任务的进度：汇总各阶段耗时，按最近一段时间的吞吐量估算剩余时间，
+        定期改写JSON状态文件，可选在控制台输出进度，便于运行中发现共享盘变慢、TTS限流等问题
+        :param status_path: 状态文件路径，.json文件
+        :param total_videos: 本批要合成的视频数
+        :param window: 滚动统计的时间窗口（秒）
+        :param interval: 改写状态文件的间隔（秒）
+        :param console: 是否在控制台输出进度
+        """
+        self.status_path = status_path
+        self.total_videos = total_videos
+        self.window = window
+        self.interval = interval
+        self.console = console
+
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._pipeline: Pipeline = None
+        self._videos_done = 0
+        self._videos_failed = 0
+        self._output_seconds = 0.0
+        self._completions = deque()  # (完成时间, 视频秒数)
+        self._stages: Dict[str, Dict] = dict()
+
+        self._stopping = threading.Event()
+        self._thread: threading.Thread = None
+
+    def attach(self, pipeline: Pipeline):
+        """
+        关联流水线，状态中附带各阶段的工作线程数和队列积压
+        :param pipeline: 流水线
+        :return:
+        """
+        self._pipeline = pipeline
+
+    def add_total(self, videos: int):
+        with self._lock:
+            self.total_videos += videos
+
+    def on_stage_done(self, stage: Stage, seconds: float, item=None):
+        """
+        流水线的耗时统计函数，见Pipeline的monitor
+        """
+        now = time.time()
+        with self._lock:
+            stats = self._stages.setdefault(stage.name, {"items": 0, "busy_seconds": 0.0, "recent": deque()})
+            stats["items"] += 1
+            stats["busy_seconds"] += seconds
+            stats["recent"].append((now, seconds))
+            self._trim(stats["recent"], now)
+
+    def on_video_done(self, output_seconds: float):
+        now = time.time()
+        with self._lock:
+            self._videos_done += 1
+            self._output_seconds += output_seconds
+            self._completions.append((now, output_seconds))
+            self._trim(self._completions, now)
+
+    def on_video_failed(self):
+        with self._lock:
+            self._videos_failed += 1
+
+    def _trim(self, records: deque, now: float):
+        while records and records[0][0] < now - self.window:
+            records.popleft()
+
+    def get_status(self) -> Dict:
+        """
+        获取当前进度
+        :return:
+        """
+        now = time.time()
+        with self._lock:
+            elapsed = now - self._started_at
+            span = min(self.window, elapsed) or 1e-9  # 滚动窗口的实际长度，刚开始时不足一个窗口
+            self._trim(self._completions, now)
+
+            recent_videos = len(self._completions)
+            recent_output_seconds = sum(seconds for _, seconds in self._completions)
+            videos_left = max(0, self.total_videos - self._videos_done - self._videos_failed)
+            eta_seconds: Union[float, None] = videos_left / (recent_videos / span) if recent_videos else None
+
+            queue_sizes = self._pipeline.get_queue_sizes() if self._pipeline else dict()
+            workers = {stage.name: stage.workers for stage in self._pipeline.stages} if self._pipeline else dict()
+            stages = dict()
+            for name, stats in self._stages.items():
+                self._trim(stats["recent"], now)
+                recent_busy = sum(seconds for _, seconds in stats["recent"])
+                stages[name] = {
+                    "items": stats["items"],
+                    "avg_seconds": round(stats["busy_seconds"] / stats["items"], 2),
+                    "recent_avg_seconds": round(recent_busy / len(stats["recent"]), 2) if stats["recent"] else None,
+                    "utilization": round(recent_busy / (span * workers.get(name, 1)), 2),  # 接近1说明该阶段是瓶颈
+                    "queue_depth": queue_sizes.get(name, 0),
+                }
+
+            return {
+                "updated_at": datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"),
+                "elapsed_seconds": round(elapsed, 2),
+                "videos_total": self.total_videos,
+                "videos_done": self._videos_done,
+                "videos_failed": self._videos_failed,
+                "output_seconds": round(self._output_seconds, 2),
+                "throughput": round(self._output_seconds / elapsed, 4) if elapsed else 0.0,  # 每秒合成的视频秒数
+                "recent_throughput": round(recent_output_seconds / span, 4),
+                "eta_seconds": round(eta_seconds, 2) if eta_seconds is not None else None,
+                "eta": (datetime.datetime.fromtimestamp(now + eta_seconds).strftime("%Y-%m-%d %H:%M:%S")
+                        if eta_seconds is not None else None),
+                "stages": stages,
+            }
+
+    def write(self):
+        """
+        改写状态文件，先写临时文件再替换，读取方不会读到写了一半的文件
+        :return:
+        """
+        status = self.get_status()
+        os.makedirs(os.path.dirname(self.status_path), exist_ok=True)
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, mode='w', encoding='utf-8') as f:
+            json.dump(status, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, self.status_path)
+
+        if self.console:
+            stages = "，".join(f"{name} {stats['recent_avg_seconds'] or stats['avg_seconds']}秒/个 "
+                              f"占用{stats['utilization']:.0%} 积压{stats['queue_depth']}"
+                              for name, stats in status["stages"].items())
+            eta = str(datetime.timedelta(seconds=int(status["eta_seconds"]))) if status["eta_seconds"] is not None else "未知"
+            # 直接写标准错误输出：控制台日志只在debug环境开启，正式环境也要能看到进度
+            print(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} 进度：{status['videos_done']}/{status['videos_total']}个视频，"
+                  f"失败{status['videos_failed']}个，吞吐量{status['recent_throughput']}秒/秒，预计剩余{eta}；{stages}",
+                  file=sys.stderr, flush=True)
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                logger.warning(f"进度状态文件写入失败：{e}")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        停止定期改写，并写入最终状态
+        :return:
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+
+def create_batch_progress(total_videos: int = 0) -> BatchProgress:
+    """
+    按配置创建整批任务的进度
+    :param total_videos: 本批要合成的视频数
+    :return:
+    """
+    return BatchProgress(status_path=os.path.join(BASE_DIR, config["progress"]["status_file"]),
+                         total_videos=total_videos,
+                         window=config["progress"]["window"],
+                         interval=config["progress"]["interval"],
+                         console=config["progress"]["console"])
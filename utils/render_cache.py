@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, Union
+
+from conf.config import config, logger, BASE_DIR
+from utils.file_cache import FileCache
+from utils.media_cache import media_cache
+
+
+def recipe_hash(recipe: Dict) -> str:
+    """
+    计算产物配方的哈希值。配方相同的产物（音频、片段等）内容相同，可直接复用
+    :param recipe: 配方，须可json序列化
+    :return:
+    """
+    recipe_str = json.dumps(recipe, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(recipe_str.encode("utf-8")).hexdigest()
+
+
+def get_file_fingerprint(file_path: str) -> Dict:
+    """
+    获取文件指纹，文件被替换后指纹随之改变（文件状态在进程内缓存，见MediaCache.stat）
+    :param file_path: 文件全路径
+    :return:
+    """
+    stat = media_cache.stat(file_path)
+    return {"path": file_path, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class RenderCache(object):
+    def __init__(self, cache_dir: str, max_bytes: int, enable: bool = True):
+        """
+        按配方哈希寻址的渲染产物缓存，程序崩溃重跑或不同视频中出现相同片段时直接复用已渲染的产物
+        :param cache_dir: 缓存文件夹
+        :param max_bytes: 缓存的最大字节数
+        :param enable: 是否启用缓存
+        """
+        self.enable = enable
+        if enable:
+            self._file_cache = FileCache(cache_dir=cache_dir, max_bytes=max_bytes)
+
+    def load(self, key: str, output_path: str) -> bool:
+        """
+        缓存命中时把产物复制到输出路径
+        :param key: 缓存键，配方哈希值 + 扩展名
+        :param output_path: 输出路径
+        :return: 是否命中
+        """
+        if not self.enable:
+            return False
+
+        cache_path = self._file_cache.get(key)
+        if cache_path is None:
+            return False
+
+        shutil.copyfile(cache_path, output_path)
+        logger.info(f"复用已缓存的产物：{key} -> {output_path}")
+        return True
+
+    def get_path(self, key: str) -> Union[str, None]:
+        """
+        获取已缓存产物的路径，不复制
+        :param key: 缓存键，配方哈希值 + 扩展名
+        :return: 未命中时为None
+        """
+        if not self.enable:
+            return None
+
+        return self._file_cache.get(key)
+
+    def save(self, key: str, file_path: str) -> Union[str, None]:
+        """
+        把渲染好的产物放入缓存
+        :param key: 缓存键，配方哈希值 + 扩展名
+        :param file_path: 产物路径
+        :return: 缓存文件路径
+        """
+        if not self.enable:
+            return None
+
+        return self._file_cache.put(key, file_path)
+
+
+render_cache = RenderCache(
+    cache_dir=os.path.join(BASE_DIR, config["render_cache"]["cache_dir"]),
+    max_bytes=int(config["render_cache"]["max_size_gb"] * 1024 ** 3),
+    enable=config["render_cache"]["enable"]
+)
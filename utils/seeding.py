@@ -0,0 +1,29 @@
+import hashlib
+import os
+from typing import Dict, List
+
+from conf.config import config
+from utils.render_cache import recipe_hash
+
+
+def derive_seed(*parts) -> int:
+    """
+    由若干部分派生出随机种子，输入相同则种子相同，与进程、机器和调度顺序无关
+    :param parts: 种子的组成部分，例：(基础种子, 视频脚本, 第几个视频)
+    :return: 64位整数
+    """
+    digest = hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def get_task_seed(task: Dict, rows: List) -> int:
+    """
+    获取任务的随机种子：由基础种子、视频脚本和第几个视频决定。
+    同一任务重跑时配音人、封面、BGM、图片时长和素材选取都与上次一致，渲染缓存和音频缓存可以直接命中
+    :param task: 任务，可以给出"seed"覆盖配置中的基础种子
+    :param rows: 视频脚本的内容，没有视频脚本文件时按内容区分
+    :return:
+    """
+    video_script_path = task.get("video_script_path")
+    script_key = os.path.basename(video_script_path) if video_script_path else recipe_hash(rows)
+    return derive_seed(task.get("seed", config["compose_params"]["random_seed"]), script_key, task.get("index", 1))
@@ -1,7 +1,9 @@
 import os
 from typing import Tuple, List, Union
 
+import cv2
 import numpy as np
+from PIL import Image
 from moviepy.video.VideoClip import ColorClip, VideoClip
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 from moviepy.video.compositing.concatenate import concatenate_videoclips
@@ -10,6 +12,7 @@ from moviepy.video.fx.rotate import rotate
 from moviepy.video.io.VideoFileClip import VideoFileClip
 
 from conf.config import BASE_DIR
+from utils.memory import FrameRing
 
 
 def get_file_path_list(folder, extensions: Tuple = ('.mp4', '.avi', '.mov', '.mkv')) -> List[str]:
@@ -145,6 +148,59 @@ def add_key_frame_a2b(
     return final_clip
 
 
+def ken_burns_clip(image_path: str, size: Tuple[int, int], duration: float,
+                   zoom_start: float = 1.0, zoom_end: float = 1.2,
+                   center_start: Tuple[float, float] = (0.5, 0.5), center_end: Tuple[float, float] = (0.5, 0.5)) -> VideoClip:
+    """
+    图片的推拉摇移（Ken Burns）特效
+    原图只解码一次；每帧的裁剪窗口按时间解析计算，取原图的视图（不复制）后用一次cv2.resize得到画面，
+    单帧耗时只与输出分辨率有关，与原图分辨率无关
+
+    :param image_path: 图片路径
+    :param size: 输出的宽高，格式为(width, height)，例：(1080, 1920)
+    :param duration: 时长
+    :param zoom_start: 起始缩放倍数，1表示裁剪窗口为原图中与输出宽高比相同的最大矩形，例：1.0
+    :param zoom_end: 结束缩放倍数，大于起始倍数为推近，小于为拉远，例：1.2
+    :param center_start: 起始时裁剪窗口中心在原图中的相对位置，范围0～1，例：(0.5, 0.5)
+    :param center_end: 结束时裁剪窗口中心在原图中的相对位置，范围0～1，例：(0.6, 0.4)
+    :return:
+    """
+    width_out, height_out = size
+    image = np.asarray(Image.open(image_path).convert("RGB"))
+    frame_ring = FrameRing(shape=(height_out, width_out, 3))  # 画面会被立即合成走，复用帧缓冲区，不必每帧分配
+
+    # 原图中与输出宽高比相同的最大矩形
+    height, width = image.shape[:2]
+    base_width = min(width, height * width_out / height_out)
+
+    # 原图远大于所需时先缩小一次，保证放大到最大倍数时裁剪窗口仍不小于输出分辨率即可
+    scale = width_out * max(zoom_start, zoom_end) / base_width
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        height, width = image.shape[:2]
+        base_width = min(width, height * width_out / height_out)
+    base_height = base_width * height_out / width_out
+
+    def make_frame(t):
+        progress = min(max(t / duration, 0), 1) if duration > 0 else 0
+        zoom = zoom_start + (zoom_end - zoom_start) * progress
+        crop_width = min(width, max(1, int(round(base_width / zoom))))
+        crop_height = min(height, max(1, int(round(base_height / zoom))))
+
+        # 裁剪窗口中心，限制窗口不超出原图
+        center_x = (center_start[0] + (center_end[0] - center_start[0]) * progress) * width
+        center_y = (center_start[1] + (center_end[1] - center_start[1]) * progress) * height
+        x0 = int(round(min(max(center_x - crop_width / 2, 0), width - crop_width)))
+        y0 = int(round(min(max(center_y - crop_height / 2, 0), height - crop_height)))
+
+        view = image[y0:y0 + crop_height, x0:x0 + crop_width]
+        return cv2.resize(view, (width_out, height_out), dst=frame_ring.next(), interpolation=cv2.INTER_LINEAR)
+
+    clip = VideoClip(make_frame, duration=duration)
+    clip.close = frame_ring.close  # 关闭剪辑时归还帧缓冲区
+    return clip
+
+
 def main():
     video_clip1: VideoClip = VideoFileClip(os.path.join(BASE_DIR, "example/1.mp4"))
     video_clip2: VideoClip = VideoFileClip(os.path.join(BASE_DIR, "example/2.mp4"))
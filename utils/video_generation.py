@@ -1,46 +1,47 @@
 import math
 import os
 import random
-from typing import List
+import subprocess
+from typing import List, Dict, Union, Tuple
 
 import cv2
+import numpy as np
 from PIL import Image
 from moviepy.audio.fx.audio_fadeout import audio_fadeout
 from moviepy.audio.AudioClip import concatenate_audioclips, CompositeAudioClip
 from moviepy.audio.fx.audio_loop import audio_loop
 from moviepy.audio.fx.volumex import volumex
 from moviepy.audio.io.AudioFileClip import AudioFileClip
+from moviepy.config import FFMPEG_BINARY
 from moviepy.editor import ImageClip
 from moviepy.video.VideoClip import TextClip, VideoClip
-from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
-from moviepy.video.compositing.concatenate import concatenate_videoclips
-from moviepy.video.compositing.transitions import crossfadein
 from moviepy.video.fx.resize import resize
 from moviepy.video.io.VideoFileClip import VideoFileClip
 from moviepy.video.tools.subtitles import SubtitlesClip
 
 import conf
 from conf.config import logger, config, BASE_DIR
-from utils.audio_generation import Subtitle, audio_normalize
+from utils.audio_generation import Subtitle
+from utils.compositor import StaticLayer, ClipLayer, render_layers
+from utils.loudness import loudness_index
+from utils.media_cache import media_cache
+from utils.media_index import get_file_type, media_index, to_media_pool, MediaPool, SimilarityGuard
+from utils.memory import FrameRing
+from utils.render_cache import get_file_fingerprint
+from utils.tools import ken_burns_clip
 
 
-def get_file_type(file_path: str) -> str:
-    """
-    获取文件类型
-    :param file_path:文件全路径
-    :return:
-    """
-    image_extensions = ['.jpg', '.jpeg', '.png', '.gif']
-    video_extensions = ['.mp4', '.avi', '.mov']
+# 视频编码参数
+ENCODE_PARAMS = {
+    "fps": 30,
+    "codec": "mpeg4",
+    "bitrate": "10000k",
+    "audio_codec": "aac",
+}
 
-    file_extension = os.path.splitext(file_path)[-1].lower()
-
-    if file_extension in image_extensions:
-        return 'image'
-    elif file_extension in video_extensions:
-        return 'video'
-    else:
-        return 'unknown'
+# 渲染方式的版本，写入片段配方。修改了渲染代码、同样的配方渲染出的画面会不同时递增，旧的片段缓存随之失效
+# 2: 缩放、转场淡入和字幕定位改由compositor绘制
+RENDER_VERSION = 2
 
 
 def is_vertical_material(file_path: str) -> bool:
@@ -51,62 +52,425 @@ def is_vertical_material(file_path: str) -> bool:
     :return:
     """
     file_type = get_file_type(file_path)
+    local_path = media_cache.get_local_path(file_path)  # 读本地缓存，不在远程路径上探测
     if file_type == "image":
-        img = Image.open(file_path)
-        width, height = img.size
+        with Image.open(local_path) as img:
+            width, height = img.size
     elif file_type == "video":
-        cap = cv2.VideoCapture(file_path)
-        width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        cap = cv2.VideoCapture(local_path)
+        try:
+            width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+            height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        finally:
+            cap.release()
     else:
         raise ValueError("不支持的文件类型")
     return height > width
 
 
+def close_clips(clips: List):
+    """
+    关闭剪辑，释放其占用的读取进程和内存
+    :param clips: 剪辑列表
+    :return:
+    """
+    for clip in clips:
+        try:
+            clip.close()
+        except Exception as e:
+            logger.warning(f"剪辑关闭失败：{e}")
+
+
+def get_video_stream_info(file_path: str) -> Dict:
+    """
+    获取视频流的宽高、帧率和编码格式，用于判断片段能否直接流复制
+    :param file_path: 视频文件的全路径
+    :return:
+    """
+    cap = cv2.VideoCapture(file_path)
+    try:
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": round(cap.get(cv2.CAP_PROP_FPS), 2),
+            "fourcc": int(cap.get(cv2.CAP_PROP_FOURCC)),
+        }
+    finally:
+        cap.release()
+
+
+def can_stream_copy(video_path_list: List[str], size: Tuple[int, int] = None) -> bool:
+    """
+    判断视频片段能否不经解码、直接流复制拼接：宽高、帧率和编码格式均与输出一致
+    :param video_path_list: 视频片段路径列表
+    :param size: 输出的宽高，为空时为主视频的宽高
+    :return:
+    """
+    width, height = size or (config["compose_params"]["background_width"], config["compose_params"]["background_height"])
+    expected = {
+        "width": width,
+        "height": height,
+        "fps": round(float(ENCODE_PARAMS["fps"]), 2),
+    }
+    stream_info_list = [get_video_stream_info(video_path) for video_path in video_path_list]
+    for stream_info in stream_info_list:
+        if any(stream_info[key] != value for key, value in expected.items()):
+            return False
+        if stream_info["fourcc"] != stream_info_list[0]["fourcc"]:
+            return False
+
+    return True
+
+
+def concat_video_stream_copy(video_path_list: List[str], audio_path: str, video_output_path: str):
+    """
+    用ffmpeg的concat demuxer流复制拼接视频片段，并混入音频，全程不解码视频
+    :param video_path_list: 视频片段路径列表
+    :param audio_path: 音频文件路径
+    :param video_output_path: 视频输出路径
+    :return:
+    """
+    concat_list_path = f"{os.path.splitext(video_output_path)[0]}_concat.txt"
+    with open(concat_list_path, "w", encoding="utf-8") as f:
+        for video_path in video_path_list:
+            video_path = os.path.abspath(video_path).replace("'", "'\\''")
+            f.write(f"file '{video_path}'\n")
+
+    command = [
+        FFMPEG_BINARY, "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", concat_list_path,
+        "-i", audio_path,
+        "-map", "0:v", "-map", "1:a",
+        "-c", "copy",
+        video_output_path,
+    ]
+    try:
+        subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"视频片段流复制拼接失败：{e.stderr.decode('utf-8', errors='ignore')}")
+    finally:
+        os.remove(concat_list_path)
+
+
+def get_temp_audio_path(video_output_path: str) -> str:
+    """
+    获取写视频时临时音频文件的路径，与视频放在同一文件夹。
+    临时音频不能按输出文件名放在公共目录，不同视频的同名片段（如1.mp4）并发渲染时会读到彼此的音频
+    :param video_output_path: 视频输出路径
+    :return:
+    """
+    return f"{os.path.splitext(video_output_path)[0]}_temp_audio.m4a"
+
+
+def get_rendition_path(video_path: str, rendition_name: str) -> str:
+    """
+    获取分辨率版本的输出路径，例：xxx.mp4 -> xxx_720p.mp4
+    :param video_path: 主视频路径
+    :param rendition_name: 分辨率版本名
+    :return:
+    """
+    base, ext = os.path.splitext(video_path)
+    return f"{base}_{rendition_name}{ext}"
+
+
+def get_rendition_bitrate(rendition: Dict, size: Tuple[int, int]) -> str:
+    """
+    获取分辨率版本的码率：未指定bitrate时按像素数相对主视频等比换算
+    :param rendition: 分辨率版本，例：{"name": "720p", "width": 720, "height": 1280}
+    :param size: 主视频的宽高
+    :return:
+    """
+    if rendition.get("bitrate"):
+        return rendition["bitrate"]
+    master_bitrate = int(ENCODE_PARAMS["bitrate"].rstrip("k"))
+    return f"{max(1, round(master_bitrate * rendition['width'] * rendition['height'] / (size[0] * size[1])))}k"
+
+
+def is_same_aspect(rendition: Dict, size: Tuple[int, int]) -> bool:
+    """
+    判断分辨率版本与主视频的宽高比是否一致
+    :param rendition: 分辨率版本，例：{"name": "720p", "width": 720, "height": 1280}
+    :param size: 主视频的宽高
+    :return:
+    """
+    return abs(rendition["width"] / rendition["height"] - size[0] / size[1]) <= 0.01
+
+
+def get_canvas_sizes(renditions: List[Dict]) -> Dict[Union[str, None], Tuple[int, int]]:
+    """
+    获取需要各自排版绘制的画布：主视频，以及宽高比与主视频不同的分辨率版本。
+    宽高比相同的版本由主视频的画面直接缩放，不需要自己的画布
+    :param renditions: 分辨率版本列表
+    :return: {分辨率版本名（主视频为None）: 画布尺寸(width, height)}
+    """
+    size = (config["compose_params"]["background_width"], config["compose_params"]["background_height"])
+    canvas_sizes = {None: size}
+    for rendition in renditions:
+        if not is_same_aspect(rendition, size):
+            canvas_sizes[rendition["name"]] = (rendition["width"], rendition["height"])
+
+    return canvas_sizes
+
+
+def get_canvas_layout(canvas_size: Tuple[int, int]) -> Tuple[float, int, int]:
+    """
+    主视频的画面等比缩放后居中放到画布上时的缩放倍数和边距，宽高比不同的版本按此摆放封面、字幕和叠加图层
+    :param canvas_size: 画布尺寸(width, height)
+    :return: (缩放倍数, 左右边距, 上下边距)，主视频的画布为(1, 0, 0)
+    """
+    width, height = config["compose_params"]["background_width"], config["compose_params"]["background_height"]
+    scale = min(canvas_size[0] / width, canvas_size[1] / height)
+    return scale, round((canvas_size[0] - width * scale) / 2), round((canvas_size[1] - height * scale) / 2)
+
+
+def write_video(clip: VideoClip, video_output_path: str, renditions: List[Dict] = (),
+                rendition_clips: Dict[str, VideoClip] = None) -> Dict[str, str]:
+    """
+    编码写入视频：合成好的画面经管道交给ffmpeg进程编码，各进程并行编码，音频只编码一次，各版本直接复制。
+    宽高比与主视频相同的版本在主视频的ffmpeg进程中split后直接缩放编码，不必解码主视频再编码一次；
+    宽高比不同的版本在自己的画布上绘制（见get_canvas_sizes），与主视频逐帧同步生成，素材只解码一次，各自一个ffmpeg进程编码
+    :param clip: 合成好的剪辑，含音频
+    :param video_output_path: 主视频输出路径
+    :param renditions: 额外输出的分辨率版本，例：[{"name": "720p", "width": 720, "height": 1280}]，
+                       bitrate可选，见get_rendition_bitrate
+    :param rendition_clips: 宽高比与主视频不同的版本在各自画布上合成好的剪辑，{分辨率版本名: 剪辑}，与主视频时长相同
+    :return: {分辨率版本名: 输出路径}
+    """
+    rendition_clips = rendition_clips or dict()
+    width, height = clip.size
+    for rendition in renditions:
+        if rendition["name"] not in rendition_clips and not is_same_aspect(rendition, (width, height)):
+            raise ValueError(f"分辨率版本{rendition['name']}的宽高比与主视频（{width}x{height}）不一致，须在自己的画布上绘制")
+
+    temp_audio_path = get_temp_audio_path(video_output_path)
+    clip.audio.write_audiofile(temp_audio_path, fps=44100, codec=ENCODE_PARAMS["audio_codec"],
+                               buffersize=1000, logger=None)  # 尝试解决末尾的音频重复问题 https://github.com/Zulko/moviepy/issues/1310
+
+    def get_command(size: Tuple[int, int], filters: List[str], outputs: List[str]) -> List[str]:
+        return [
+            FFMPEG_BINARY, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-vcodec", "rawvideo", "-s", f"{size[0]}x{size[1]}", "-pix_fmt", "rgb24",
+            "-r", str(ENCODE_PARAMS["fps"]), "-i", "-",
+            "-i", temp_audio_path,
+            *(["-filter_complex", ";".join(filters)] if filters else []),
+            "-threads", str(os.cpu_count()),
+            *outputs,
+        ]
+
+    scaled_renditions = [rendition for rendition in renditions if rendition["name"] not in rendition_clips]
+    filters = [f"[0:v]split={len(scaled_renditions) + 1}[master]" + "".join(f"[v{i}]" for i in range(len(scaled_renditions)))]
+    outputs = ["-map", "[master]", "-map", "1:a", "-c:v", ENCODE_PARAMS["codec"], "-b:v", ENCODE_PARAMS["bitrate"],
+               "-c:a", "copy", video_output_path]
+    rendition_paths = dict()
+    for i, rendition in enumerate(scaled_renditions):
+        filters.append(f"[v{i}]scale={rendition['width']}:{rendition['height']},setsar=1[out{i}]")
+        rendition_path = get_rendition_path(video_output_path, rendition["name"])
+        outputs += ["-map", f"[out{i}]", "-map", "1:a", "-c:v", ENCODE_PARAMS["codec"],
+                    "-b:v", get_rendition_bitrate(rendition, (width, height)), "-c:a", "copy", rendition_path]
+        rendition_paths[rendition["name"]] = rendition_path
+    commands = [(clip, get_command((width, height), filters, outputs))]
+
+    for rendition in renditions:
+        if rendition["name"] not in rendition_clips:
+            continue
+        rendition_path = get_rendition_path(video_output_path, rendition["name"])
+        commands.append((rendition_clips[rendition["name"]], get_command(
+            (rendition["width"], rendition["height"]), [],
+            ["-map", "0:v", "-map", "1:a", "-c:v", ENCODE_PARAMS["codec"],
+             "-b:v", get_rendition_bitrate(rendition, (width, height)), "-c:a", "copy", rendition_path])))
+        rendition_paths[rendition["name"]] = rendition_path
+
+    logger.info(f"开始写入视频：{video_output_path}，分辨率版本：{list(rendition_paths.keys())}")
+    processes = [(frame_clip, subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE))
+                 for frame_clip, command in commands]
+    try:
+        for frame_index in range(int(clip.duration * ENCODE_PARAMS["fps"])):  # 与iter_frames的取帧时刻一致
+            t = frame_index / ENCODE_PARAMS["fps"]
+            for frame_clip, process in processes:  # 各画布在同一时刻取帧，共用的素材读取进程直接返回已解码的画面
+                process.stdin.write(np.ascontiguousarray(frame_clip.get_frame(t), dtype=np.uint8))  # 复用的帧缓冲区在写入后才会被覆盖
+    except BrokenPipeError:
+        pass  # ffmpeg提前退出，错误信息见下方
+    finally:
+        stderr_list = [process.communicate()[1] for _, process in processes]  # 关闭管道，等待编码结束
+        os.remove(temp_audio_path)
+    for (_, process), stderr in zip(processes, stderr_list):
+        if process.returncode != 0:
+            raise RuntimeError(f"视频写入失败：{stderr.decode('utf-8', errors='ignore')}")
+
+    return rendition_paths
+
+
+def get_overlay_layers(cover_path: str, opened_clips: List, time_offset: float = 0,
+                       canvas_size: Tuple[int, int] = None, sources: Dict[str, VideoClip] = None) -> List:
+    """
+    获取叠加在画面上的图层：铺满画面的封面，以及配置中的台标、贴纸和画中画，后面的在上层。
+    静态图层在创建时裁剪到非透明区域并预乘alpha，每帧只处理图层覆盖的区域，见compositor
+    :param cover_path: 封面路径
+    :param opened_clips: 打开的剪辑列表，画中画剪辑加入其中，由调用方统一关闭
+    :param time_offset: 画面在整个视频中的起始时间，在片段中叠加时画中画从该时间接着播放，拼接后不会在片段边界处重新开始
+    :param canvas_size: 画布尺寸，为空时为主视频的画布；宽高比不同时封面和叠加图层按get_canvas_layout等比缩放、居中摆放
+    :param sources: 已打开的画中画剪辑，{路径: 剪辑}，多个画布传入同一个字典时画中画只打开、解码一次
+    :return:
+    """
+    canvas_size = canvas_size or (config["compose_params"]["background_width"], config["compose_params"]["background_height"])
+    scale, margin_x, margin_y = get_canvas_layout(canvas_size)
+
+    def place(position: Union[int, str], margin: int) -> Union[int, str]:  # 主视频画布上的坐标换算到缩放居中后的位置
+        if isinstance(position, str):
+            return position
+        return round(position * scale) + (margin if position >= 0 else -margin)
+
+    cover_size = (round(config["compose_params"]["background_width"] * scale),
+                  round(config["compose_params"]["background_height"] * scale))
+    with Image.open(media_cache.get_local_path(cover_path)) as image:
+        cover = np.asarray(image.convert("RGBA").resize(cover_size, Image.LANCZOS))
+    layers = [StaticLayer(cover, x=margin_x, y=margin_y, canvas_size=canvas_size)]
+
+    for overlay in config["compose_params"]["overlays"]:
+        overlay_path = os.path.join(config["compose_params"]["media_root_path"], overlay["path"])
+        overlay_width = round(overlay["width"] * scale)
+        x, y = place(overlay["x"], margin_x), place(overlay["y"], margin_y)
+        if get_file_type(overlay_path) == "image":
+            with Image.open(media_cache.get_local_path(overlay_path)) as image:
+                image = image.convert("RGBA")
+                height = round(image.height * overlay_width / image.width)
+                rgba = np.asarray(image.resize((overlay_width, height), Image.LANCZOS))
+            layers.append(StaticLayer(rgba, x=x, y=y, canvas_size=canvas_size))
+        else:
+            clip = (sources or dict()).get(overlay_path)
+            if clip is None:
+                clip = VideoFileClip(media_cache.get_local_path(overlay_path), audio=False)
+                opened_clips.append(clip)
+                if sources is not None:
+                    sources[overlay_path] = clip
+            clip = resize_clip(clip, size=(overlay_width, round(clip.h * overlay_width / clip.w)))
+            opened_clips.append(clip)
+            layers.append(ClipLayer(clip, x=x, y=y, canvas_size=canvas_size, start=-time_offset))
+
+    return layers
+
+
+def get_subtitle_layer(subtitle_path: str, canvas_size: Tuple[int, int]) -> ClipLayer:
+    """
+    获取字幕图层：字号、描边和下边距按get_canvas_layout等比缩放，主视频的画布上与配置一致
+    :param subtitle_path: 字幕文件路径
+    :param canvas_size: 画布尺寸
+    :return:
+    """
+    subtitles_config = config["compose_params"]["subtitles"]
+    scale, _, margin_y = get_canvas_layout(canvas_size)
+    subtitles = SubtitlesClip(
+        subtitle_path,
+        lambda txt: TextClip(txt, font=f"{subtitles_config['font_filename']}",
+                             fontsize=round(subtitles_config["fontsize"] * scale), color=subtitles_config["color"],
+                             stroke_color=subtitles_config["stroke_color"],
+                             stroke_width=subtitles_config["stroke_width"] * scale)
+    )
+    margin_bottom = round(subtitles_config["margin"]["bottom"] * scale) + margin_y  # 字幕下边缘距画面底部的距离
+    return ClipLayer(subtitles, x="center", y=-margin_bottom if margin_bottom > 0 else "bottom",
+                     canvas_size=canvas_size, loop=False)
+
+
 def combining_video(video_path_list: List[str], audio_path_list: List[str], subtitle_path_list: List[str],
-                    cover_path: str, bgm_path: str, video_output_path: str):
+                    cover_path: Union[str, None], bgm_path: str, video_output_path: str,
+                    renditions: List[Dict] = ()) -> Dict[str, str]:
     """
-    连接视频合成最终视频
+    连接视频合成最终视频。
+    片段已叠加好封面（cover_path为空）且编码参数一致时，直接流复制拼接，只对音频进行混音编码
     :param video_path_list: 视频片段路径列表
     :param audio_path_list: 音频片段路径列表
     :param subtitle_path_list: 字幕路径列表
-    :param cover_path: 封面路径
+    :param cover_path: 封面路径，为空表示片段中已叠加封面
     :param bgm_path: 背景音乐路径
     :param video_output_path: 视频输出路径
-    :return:
+    :param renditions: 额外输出的分辨率版本，见write_video；流复制拼接时各版本也由片段的同名版本拼接，
+                       否则宽高比与主视频不同的版本由片段的同名版本合成，须已渲染，见get_canvas_sizes
+    :return: {分辨率版本名: 输出路径}
     """
-    # 合成视频
-    video_clips = [VideoFileClip(video_path) for video_path in video_path_list]
-    audio_clips = [AudioFileClip(audio_path) for audio_path in audio_path_list]
-    video_clip = concatenate_videoclips(video_clips, method="compose")
-    voice_clip = concatenate_audioclips(audio_clips)
-
-    video_clip = video_clip.without_audio()
-
-    # 加封面
-    cover_image_clip = ImageClip(cover_path).set_duration(video_clip.duration)
-    cover_image_clip = resize(cover_image_clip,
-                              newsize=(
-                                  config["compose_params"]["background_width"],
-                                  config["compose_params"]["background_height"])
-                              )
-    final_clip = CompositeVideoClip([video_clip, cover_image_clip])
-
-    # 添加人声和bgm
-    bgm_normalize_path = os.path.join(BASE_DIR, f"output/{os.path.basename(bgm_path)}")
-    bgm_normalize_path = audio_normalize(file_path=bgm_path, output_path=bgm_normalize_path)  # 归一化bgm音量，防止原声有大有小
-    bgm_clip = AudioFileClip(bgm_normalize_path)
-    bgm_clip = audio_loop(bgm_clip, duration=video_clip.duration)
-    bgm_clip = bgm_clip.fx(volumex, config["compose_params"]["bgm_volume"])
-    bgm_clip = audio_fadeout(bgm_clip, config["compose_params"]["bgm_fadeout_duration"])
-
-    final_audio_clip = CompositeAudioClip([voice_clip, bgm_clip])
-    final_clip = final_clip.set_audio(final_audio_clip)
-
-    # 保存合成的视频
-    final_clip.write_videofile(filename=video_output_path, fps=30, audio_codec="aac", codec="mpeg4",
-                               bitrate='10000k', threads=os.cpu_count(), audio_bufsize=1000)  # 尝试解决末尾的音频重复问题 https://github.com/Zulko/moviepy/issues/1310
-    final_clip.close()
+    opened_clips = list()  # 所有打开的剪辑，合成结束后统一关闭，释放读取进程和内存
+    try:
+        # 合成人声
+        audio_clips = [AudioFileClip(audio_path) for audio_path in audio_path_list]
+        opened_clips.extend(audio_clips)
+        voice_clip = concatenate_audioclips(audio_clips)
+
+        # 添加人声和bgm，按响度索引把bgm统一到目标响度，防止原声有大有小
+        bgm_gain = loudness_index.get_gain(bgm_path, target_lufs=config["loudness"]["bgm_target_lufs"],
+                                           true_peak_limit=config["loudness"]["true_peak_limit"])
+        bgm_clip = AudioFileClip(media_cache.get_local_path(bgm_path))
+        opened_clips.append(bgm_clip)
+        bgm_clip = audio_loop(bgm_clip, duration=voice_clip.duration)
+        bgm_clip = bgm_clip.fx(volumex, config["compose_params"]["bgm_volume"] * 10 ** (bgm_gain / 20))
+        bgm_clip = audio_fadeout(bgm_clip, config["compose_params"]["bgm_fadeout_duration"])
+
+        final_audio_clip = CompositeAudioClip([voice_clip, bgm_clip])
+
+        # 主视频及各分辨率版本的片段路径
+        segment_paths = {None: video_path_list}
+        for rendition in renditions:
+            segment_paths[rendition["name"]] = [get_rendition_path(video_path, rendition["name"]) for video_path in video_path_list]
+
+        if cover_path is None and can_stream_copy(video_path_list) and all(
+                all(os.path.exists(path) for path in segment_paths[rendition["name"]])
+                and can_stream_copy(segment_paths[rendition["name"]], size=(rendition["width"], rendition["height"]))
+                for rendition in renditions):
+            logger.info(f"视频片段无需转换，直接流复制拼接：{video_output_path}")
+            audio_output_path = f"{os.path.splitext(video_output_path)[0]}_audio.m4a"
+            final_audio_clip.write_audiofile(audio_output_path, fps=44100, codec="aac", bitrate="192k",
+                                             buffersize=1000)
+            rendition_paths = dict()
+            for name, paths in segment_paths.items():
+                output_path = video_output_path if name is None else get_rendition_path(video_output_path, name)
+                concat_video_stream_copy(video_path_list=paths, audio_path=audio_output_path, video_output_path=output_path)
+                if name is not None:
+                    rendition_paths[name] = output_path
+            os.remove(audio_output_path)
+            return rendition_paths
+
+        # 合成视频：片段依次居中绘制到画布上，再加封面和叠加图层；宽高比不同的版本由各自的片段在自己的画布上合成
+        canvases: Dict[Union[str, None], VideoClip] = dict()
+        overlay_sources: Dict[str, VideoClip] = dict()
+        for name, canvas_size in get_canvas_sizes(renditions).items():
+            layers = list()
+            current_duration = 0
+            for video_path in segment_paths[name]:
+                clip = VideoFileClip(video_path, audio=False)
+                opened_clips.append(clip)
+                layers.append(ClipLayer(clip, x="center", y="center", canvas_size=canvas_size, start=current_duration,
+                                        end=current_duration + clip.duration, loop=False))
+                current_duration += clip.duration
+            if cover_path:
+                layers.extend(get_overlay_layers(cover_path, opened_clips, canvas_size=canvas_size, sources=overlay_sources))
+
+            canvases[name] = render_layers(layers, canvas_size=canvas_size, duration=current_duration)
+            opened_clips.append(canvases[name])
+
+        final_clip = canvases.pop(None).set_audio(final_audio_clip)
+
+        # 保存合成的视频及各分辨率版本
+        return write_video(final_clip, video_output_path=video_output_path, renditions=renditions, rendition_clips=canvases)
+    finally:
+        close_clips(opened_clips)
+
+
+def get_cross_fade_layers(clips: List[VideoClip], canvas_size: Tuple[int, int],
+                          cross_fade_duration: float = config["compose_params"]["cross_fade_duration"]) -> Tuple[List[ClipLayer], float]:
+    """
+    以交叉淡化(叠化转场)的方式排列视频：每个片段居中放置，从第二个片段起与上一个片段重叠并淡入
+    :param clips: 视频片段
+    :param canvas_size: 画布尺寸(width, height)
+    :param cross_fade_duration: 交叉淡化时长
+    :return: (图层列表, 总时长)
+    """
+    layers = list()
+    current_duration = 0
+    for index, clip in enumerate(clips):
+        start = current_duration if index == 0 else current_duration - cross_fade_duration
+        layers.append(ClipLayer(clip, x="center", y="center", canvas_size=canvas_size, start=start,
+                                end=start + clip.duration, loop=False, fade_in=0 if index == 0 else cross_fade_duration))
+        current_duration = start + clip.duration
+
+    return layers, current_duration
 
 
 def combining_video_within_cross_fade(clips: List[VideoClip],
@@ -117,240 +481,369 @@ def combining_video_within_cross_fade(clips: List[VideoClip],
     :param cross_fade_duration: 交叉淡化时长
     :return:
     """
+    layers, duration = get_cross_fade_layers(clips, canvas_size=clips[0].size, cross_fade_duration=cross_fade_duration)
 
-    clips_new = list()
-    current_duration = 0
-    for index, clip in enumerate(clips):
-        if index == 0:
-            clips_new.append(clip)
-            current_duration += clip.duration
-        else:
-            clip: VideoClip = crossfadein(clip, cross_fade_duration)
-            clips_new.append(clip.set_start(current_duration-cross_fade_duration))
-            current_duration += (clip.duration - cross_fade_duration)
+    return render_layers(layers, canvas_size=clips[0].size, duration=duration)
 
-    final_clip = CompositeVideoClip(clips_new)
 
-    return final_clip
+def get_audio_duration(file_path: str) -> float:
+    """
+    获取音频时长
+    :param file_path: 音频文件的全路径
+    :return:
+    """
+    audio_clip = AudioFileClip(file_path)
+    try:
+        return audio_clip.duration
+    finally:
+        audio_clip.close()
 
 
-def generate_video(subtitle: Subtitle, audio_path: str, subtitle_path: str, video_output_path: str,
-                   material_direction: str, cross_fade_duration: float = config["compose_params"]["cross_fade_duration"]) -> VideoClip:
+def get_material_direction(cover_path: str) -> str:
     """
-    生成视频
-    :param cross_fade_duration: 转场时间
+    封面决定取横向还是竖向的素材
+    :param cover_path: 封面路径
+    :return: vertical或horizontal
+    """
+    return "vertical" if "_vertical" in cover_path else "horizontal"
+
+
+def get_material_size(material_direction: str, canvas_size: Tuple[int, int] = None) -> Tuple[int, int]:
+    """
+    获取素材方向对应的画面素材尺寸：主视频的画布上为配置中的素材尺寸；宽高比不同的画布上等比缩放到刚好放进画布，多出的两侧留黑边
+    :param material_direction: 素材方向
+    :param canvas_size: 画布尺寸，为空时为主视频的画布
+    :return: (width, height)
+    """
+    if material_direction == "horizontal":
+        size = (config["compose_params"]["horizontal_material_width"],
+                config["compose_params"]["horizontal_material_height"])
+    else:
+        size = (config["compose_params"]["background_width"],
+                config["compose_params"]["background_height"])
+    if canvas_size is None or tuple(canvas_size) == (config["compose_params"]["background_width"],
+                                                     config["compose_params"]["background_height"]):
+        return size
+
+    scale = min(canvas_size[0] / size[0], canvas_size[1] / size[1])
+    return round(size[0] * scale), round(size[1] * scale)
+
+
+def resize_material(clip: VideoClip, material_direction: str, canvas_size: Tuple[int, int] = None) -> VideoClip:
+    """
+    按素材方向把画面素材缩放到对应尺寸
+    :param clip: 画面素材
+    :param material_direction: 素材方向
+    :param canvas_size: 画布尺寸，见get_material_size
+    :return: 缩放后的剪辑，见resize_clip
+    """
+    return resize_clip(clip, size=get_material_size(material_direction, canvas_size))
+
+
+def resize_clip(clip: VideoClip, size: Tuple[int, int]) -> VideoClip:
+    """
+    缩放剪辑。图片只缩放一次；视频每帧缩放到复用的帧缓冲区中，画面会被立即绘制到画布上，不必每帧分配
+    :param clip: 剪辑，不含遮罩
+    :param size: 目标尺寸(width, height)
+    :return: 缩放后的剪辑，关闭时只归还帧缓冲区，原剪辑由调用方关闭
+    """
+    size = tuple(size)
+    if tuple(clip.size) == size:
+        return clip
+    if isinstance(clip, ImageClip):
+        return resize(clip=clip, newsize=size)
+
+    frame_ring = FrameRing(shape=(size[1], size[0], 3))
+    interpolation = cv2.INTER_AREA if clip.w > size[0] else cv2.INTER_LINEAR  # 与moviepy的缩放方式一致
+    resized_clip = clip.fl_image(lambda frame: cv2.resize(frame, size, dst=frame_ring.next(), interpolation=interpolation))
+    resized_clip.close = frame_ring.close
+    return resized_clip
+
+
+def get_ken_burns_params(rng: random.Random = random) -> Dict:
+    """
+    随机生成图片推拉摇移特效的参数：随机推近或拉远，裁剪窗口中心在一定范围内随机平移
+    :param rng: 随机数生成器
+    :return: ken_burns_clip的参数
+    """
+    zoom_start = config["ken_burns"]["zoom_min"]
+    zoom_end = config["ken_burns"]["zoom_max"]
+    if rng.random() < 0.5:
+        zoom_start, zoom_end = zoom_end, zoom_start
+
+    pan = config["ken_burns"]["pan"]
+    return {
+        "zoom_start": zoom_start,
+        "zoom_end": zoom_end,
+        "center_start": (0.5 + rng.uniform(-pan, pan), 0.5 + rng.uniform(-pan, pan)),
+        "center_end": (0.5 + rng.uniform(-pan, pan), 0.5 + rng.uniform(-pan, pan)),
+    }
+
+
+def plan_video(subtitle: Subtitle, subtitle_filename: str, audio_duration: float, material_direction: str,
+               cross_fade_duration: float = config["compose_params"]["cross_fade_duration"],
+               guard: SimilarityGuard = None, medias_used: Dict = None, video_cut_points: Dict = None,
+               rng: random.Random = random) -> List[Dict]:
+    """
+    规划视频片段的时间线：按音频时长依次选取画面素材及其裁剪区间。
+    注意：默认消耗conf.config中的medias_used和video_cut_points，多线程调用时需持有conf.config.state_lock
     :param subtitle: 字幕对象
-    :param audio_path: 音频文件路径
-    :param subtitle_path: 字幕文件路径
+    :param subtitle_filename: 字幕文件名，用作素材去重的键
+    :param audio_duration: 音频时长，即视频的最终时长
     :param material_direction: 素材方向
-    :param video_output_path: 视频输出路径
-    :return:
+    :param cross_fade_duration: 转场时间
+    :param guard: 相似度守卫，选取素材时避开与已用素材近似重复的
+    :param medias_used: 素材使用情况，为空时用conf.config.medias_used；试运行时传入副本，不影响真实状态
+    :param video_cut_points: 视频切割点，为空时用conf.config.video_cut_points
+    :param rng: 随机数生成器，传入由任务派生的生成器时，同样的素材使用情况下规划结果可重现
+    :return: 时间线，例：[{"type": "image", "path": "...", "duration": 1.2},
+                         {"type": "video", "path": "...", "t_start": 3.0, "t_end": 5.5}, ...]
     """
-    subtitle_filename = os.path.basename(subtitle_path)
+    if medias_used is None:
+        medias_used = conf.config.medias_used
+    if video_cut_points is None:
+        video_cut_points = conf.config.video_cut_points
+
     # 获取视频画面素材
-    if subtitle_filename not in conf.config.medias_used.keys():
+    if subtitle_filename not in medias_used.keys():
         media_path = os.path.join(config["compose_params"]["media_root_path"], subtitle.metadata["media_path"])
 
-        medias = list()
-        for filename in os.listdir(media_path):
-            file_path = os.path.join(media_path, filename)
-
-            if filename.startswith(('.', 'Thumbs.db')):
-                continue
+        medias = MediaPool(
+            file_path for file_path in media_cache.listdir(media_path)
+            if media_index.is_vertical(file_path) == (material_direction == "vertical")
+        )
 
-            if material_direction == "vertical" and is_vertical_material(str(file_path)):
-                medias.append(file_path)
-            elif material_direction == "horizontal" and not is_vertical_material(str(file_path)):
-                medias.append(file_path)
+        medias_used[f"{subtitle_filename}"] = medias
+    medias_used[f"{subtitle_filename}"] = to_media_pool(medias_used[f"{subtitle_filename}"])
 
-        conf.config.medias_used[f"{subtitle_filename}"] = medias
-
-    video_final_duration = AudioFileClip(audio_path).duration  # 视频的最终时长
+    video_final_duration = audio_duration  # 视频的最终时长
     video_current_duration = 0  # 视频的当前时长
     video_left_duration = video_final_duration  # 时间轴剩余时长
-    video_clips: List[ImageClip, VideoFileClip] = list()
+    timeline: List[Dict] = list()
 
     i = 1
-    while conf.config.medias_used[f"{subtitle_filename}"]:
-        media_path = random.choice(conf.config.medias_used[f"{subtitle_filename}"])
+    while medias_used[f"{subtitle_filename}"]:
+        media_path = medias_used[f"{subtitle_filename}"].choice(
+            rng=rng, guard=guard, max_attempts=config["media_index"]["max_attempts"])
         logger.info(f"选取的素材：{media_path}")
+        if guard is not None:
+            guard.add(media_path)
 
         media_type = get_file_type(file_path=media_path)
 
         if media_type == "image":
-            conf.config.medias_used[f"{subtitle_filename}"].remove(media_path)
+            medias_used[f"{subtitle_filename}"].remove(media_path)
 
             if i == 1:
-                image_duration = random.uniform(config["compose_params"]["image_duration"]["min"],
-                                                config["compose_params"]["image_duration"]["max"])
+                image_duration = rng.uniform(config["compose_params"]["image_duration"]["min"],
+                                             config["compose_params"]["image_duration"]["max"])
             else:
-                image_duration = random.uniform(
+                image_duration = rng.uniform(
                     config["compose_params"]["image_duration"]["min"] + cross_fade_duration,
                     config["compose_params"]["image_duration"]["max"] + cross_fade_duration)
 
-            image_clip = ImageClip(media_path).set_duration(min(video_left_duration, image_duration))
-            if material_direction == "horizontal":
-                image_clip = resize(clip=image_clip,
-                                    newsize=(
-                                        config["compose_params"]["horizontal_material_width"],
-                                        config["compose_params"]["horizontal_material_height"])
-                                    )
-            else:
-                image_clip = resize(clip=image_clip,
-                                    newsize=(
-                                        config["compose_params"]["background_width"],
-                                        config["compose_params"]["background_height"])
-                                    )
-
-            video_clips.append(image_clip)
+            # 非首个素材有一段与上一个素材重叠（转场），要多留出转场时间，否则时间轴永远差一个转场时间填不满
+            image_duration = min(video_left_duration if i == 1 else video_left_duration + cross_fade_duration, image_duration)
+            timeline.append({
+                "type": "image", "path": media_path, "duration": image_duration,
+                "ken_burns": get_ken_burns_params(rng) if config["ken_burns"]["enable"] else None,
+            })
             if i == 1:
-                video_current_duration += image_clip.duration
+                video_current_duration += image_duration
             else:
-                video_current_duration += (image_clip.duration - cross_fade_duration)
-            video_left_duration = video_final_duration - video_current_duration
-            i += 1
-
-            logger.info(
-                f"当前时长：{video_current_duration} 剩余时长:：{video_left_duration} 最终时长：{video_final_duration}")
-
-            # 这里不能用等于0来判断时间轴是否已经填满，因为浮点数计算时会有误差，差值可能会是一个无限接近0的数，所以这里用0.01近似表示相等。
-            if abs(video_final_duration - video_current_duration) < 0.01:
-                break
+                video_current_duration += (image_duration - cross_fade_duration)
         elif media_type == "video":
-            if media_path not in conf.config.video_cut_points.keys():
-                conf.config.video_cut_points[f"{media_path}"] = 0
+            if media_path not in video_cut_points.keys():
+                video_cut_points[f"{media_path}"] = 0
 
-            video_clip = VideoFileClip(media_path)
+            video_duration = media_index.get(media_path)["duration"]
+            # 从上次的切割点继续使用时，对齐到随后的镜头切换点，避免从镜头中间切入
+            t_start = media_index.snap_cut_point(media_path, video_cut_points[f"{media_path}"],
+                                                 tolerance=config["media_index"]["shot_snap_tolerance"])
 
             if i == 1:
-                if (video_clip.duration - conf.config.video_cut_points[f"{media_path}"]) <= video_left_duration:
-                    conf.config.medias_used.get(f"{subtitle_filename}").remove(media_path)
-                    t_start = conf.config.video_cut_points[f"{media_path}"]
-                    t_end = video_clip.duration
-                    video_clip = video_clip.subclip(t_start, t_end)
-                else:
-                    t_start = conf.config.video_cut_points[f"{media_path}"]
-                    t_end = conf.config.video_cut_points[f"{media_path}"] + video_left_duration
-                    video_clip = video_clip.subclip(t_start, t_end)
-                    conf.config.video_cut_points[f"{media_path}"] = conf.config.video_cut_points[f"{media_path}"] + video_left_duration
-
-                if material_direction == "horizontal":
-                    video_clip = resize(clip=video_clip,
-                                        newsize=(
-                                            config["compose_params"]["horizontal_material_width"],
-                                            config["compose_params"]["horizontal_material_height"])
-                                        )
+                if (video_duration - t_start) <= video_left_duration:
+                    medias_used.get(f"{subtitle_filename}").remove(media_path)
+                    t_end = video_duration
                 else:
-                    video_clip = resize(clip=video_clip,
-                                        newsize=(
-                                            config["compose_params"]["background_width"],
-                                            config["compose_params"]["background_height"])
-                                        )
-
-                video_clips.append(video_clip)
-                video_current_duration += video_clip.duration
-                video_left_duration = video_final_duration - video_current_duration
-                i += 1
-
-                logger.info(
-                        f"当前时长：{video_current_duration} 剩余时长:：{video_left_duration} 最终时长：{video_final_duration}")
-                if abs(video_final_duration - video_current_duration) < 0.01:
-                    break
+                    t_end = t_start + video_left_duration
+                    video_cut_points[f"{media_path}"] = t_end
+
+                video_current_duration += (t_end - t_start)
             else:
-                if (video_clip.duration - conf.config.video_cut_points[f"{media_path}"] - cross_fade_duration) <= video_left_duration:
-                    t_start = conf.config.video_cut_points[f"{media_path}"]
-                    t_end = video_clip.duration
-                    video_clip = video_clip.subclip(t_start, t_end)
-
-                    if material_direction == "horizontal":
-                        video_clip = resize(clip=video_clip,
-                                            newsize=(
-                                                config["compose_params"]["horizontal_material_width"],
-                                                config["compose_params"]["horizontal_material_height"])
-                                            )
-                    else:
-                        video_clip = resize(clip=video_clip,
-                                            newsize=(
-                                                config["compose_params"]["background_width"],
-                                                config["compose_params"]["background_height"])
-                                            )
-
-                    conf.config.medias_used.get(f"{subtitle_filename}").remove(media_path)
-                    video_clips.append(video_clip)
-                    video_current_duration += (video_clip.duration - cross_fade_duration)
-                    video_left_duration = video_final_duration - video_current_duration
-                    i += 1
-
-                    logger.info(
-                        f"当前时长：{video_current_duration} 剩余时长:：{video_left_duration} 最终时长：{video_final_duration}")
-                    if abs(video_final_duration - video_current_duration) < 0.01:
-                        break
+                if (video_duration - t_start - cross_fade_duration) <= video_left_duration:
+                    medias_used.get(f"{subtitle_filename}").remove(media_path)
+                    t_end = video_duration
                 else:
-                    t_start = conf.config.video_cut_points[f"{media_path}"]
-                    t_end = conf.config.video_cut_points[f"{media_path}"] + video_left_duration + cross_fade_duration
-                    video_clip = video_clip.subclip(t_start, t_end)
-
-                    if material_direction == "horizontal":
-                        video_clip = resize(clip=video_clip,
-                                            newsize=(
-                                                config["compose_params"]["horizontal_material_width"],
-                                                config["compose_params"]["horizontal_material_height"])
-                                            )
-                    else:
-                        video_clip = resize(clip=video_clip,
-                                            newsize=(
-                                                config["compose_params"]["background_width"],
-                                                config["compose_params"]["background_height"])
-                                            )
-
-                    conf.config.video_cut_points[f"{media_path}"] = conf.config.video_cut_points[
-                                                            f"{media_path}"] + video_left_duration + cross_fade_duration
-
-                    video_clips.append(video_clip)
-                    video_current_duration += (video_clip.duration - cross_fade_duration)
-                    video_left_duration = video_final_duration - video_current_duration
-                    i += 1
-
-                    logger.info(
-                        f"当前时长：{video_current_duration} 剩余时长:：{video_left_duration} 最终时长：{video_final_duration}")
-                    if abs(video_final_duration - video_current_duration) < 0.01:
-                        break
+                    t_end = t_start + video_left_duration + cross_fade_duration
+                    video_cut_points[f"{media_path}"] = t_end
+
+                video_current_duration += (t_end - t_start - cross_fade_duration)
+
+            timeline.append({"type": "video", "path": media_path, "t_start": t_start, "t_end": t_end})
         else:
             raise ValueError(f"不支持该类型的媒体文件：{media_path}")
 
+        video_left_duration = video_final_duration - video_current_duration
+        i += 1
+
+        logger.info(
+            f"当前时长：{video_current_duration} 剩余时长:：{video_left_duration} 最终时长：{video_final_duration}")
+
+        # 这里不能用等于0来判断时间轴是否已经填满，因为浮点数计算时会有误差，差值可能会是一个无限接近0的数，所以这里用0.01近似表示相等。
+        if abs(video_final_duration - video_current_duration) < 0.01:
+            break
+
     if not (abs(video_final_duration - video_current_duration) < 0.01):
         raise ValueError(f'字幕{subtitle_filename}的素材已使用完。')
 
-    # 合成视频
-    video_clip = combining_video_within_cross_fade(video_clips, cross_fade_duration=cross_fade_duration)
+    return timeline
 
-    # 合成字幕
-    subtitles = SubtitlesClip(
-        subtitle_path,
-        lambda txt: TextClip(txt, font=f"{config['compose_params']['subtitles']['font_filename']}",
-                             fontsize=config["compose_params"]["subtitles"]["fontsize"], color=config["compose_params"]["subtitles"]["color"],
-                             stroke_color=config["compose_params"]["subtitles"]["stroke_color"],
-                             stroke_width=config["compose_params"]["subtitles"]["stroke_width"])
-    )
 
-    video_clip = CompositeVideoClip(
-        clips=[
-            video_clip.set_position(("center", "center")),
-            subtitles.set_position(("center", "bottom")).margin(bottom=config["compose_params"]["subtitles"]["margin"]["bottom"], opacity=0)
-        ],
-        size=(config["compose_params"]["background_width"], config["compose_params"]["background_height"])
-    )
+def render_video(timeline: List[Dict], audio_path: str, subtitle_path: str, video_output_path: str,
+                 material_direction: str, cross_fade_duration: float = config["compose_params"]["cross_fade_duration"],
+                 cover_path: str = None, renditions: List[Dict] = (), time_offset: float = 0) -> VideoClip:
+    """
+    按规划好的时间线渲染视频片段
+    :param timeline: 时间线，见plan_video
+    :param audio_path: 音频文件路径
+    :param subtitle_path: 字幕文件路径
+    :param video_output_path: 视频输出路径
+    :param material_direction: 素材方向
+    :param cross_fade_duration: 转场时间
+    :param cover_path: 封面路径，不为空时在片段中叠加封面，组合片段时就无需再解码重编码
+    :param renditions: 额外输出的分辨率版本，见write_video；宽高比与主视频不同的版本按同一时间线在自己的画布上排版
+    :param time_offset: 片段在整个视频中的起始时间，见get_timeline_duration，画中画据此接着上一个片段播放
+    :return:
+    """
+    opened_clips = list()  # 所有打开的剪辑，渲染结束后统一关闭，释放读取进程和内存
+    try:
+        # 素材只打开一次，各画布共用；各画布在同一时刻取帧，读取进程直接返回已解码的画面，不重复解码
+        sources: List[Union[VideoClip, None]] = list()
+        for media in timeline:
+            if media["type"] == "image" and media.get("ken_burns"):
+                source = None  # 推拉摇移按画布上的素材尺寸逐帧裁剪原图，见ken_burns_clip
+            elif media["type"] == "image":
+                source = ImageClip(media_cache.get_local_path(media["path"])).set_duration(media["duration"])
+                opened_clips.append(source)
+            else:
+                source = VideoFileClip(media_cache.get_local_path(media["path"]), audio=False)
+                opened_clips.append(source)
+                source = source.subclip(media["t_start"], media["t_end"])
+            sources.append(source)
+
+        canvases: Dict[Union[str, None], VideoClip] = dict()
+        overlay_sources: Dict[str, VideoClip] = dict()
+        for name, canvas_size in get_canvas_sizes(renditions).items():
+            video_clips: List[VideoClip] = list()
+            for media, source in zip(timeline, sources):
+                if source is None:
+                    clip = ken_burns_clip(media_cache.get_local_path(media["path"]),
+                                          size=get_material_size(material_direction, canvas_size),
+                                          duration=media["duration"], **media["ken_burns"])
+                else:
+                    clip = resize_material(source, material_direction, canvas_size)
+                opened_clips.append(clip)
+                video_clips.append(clip)
+
+            # 素材、字幕、封面和叠加图层依次绘制到同一块复用的画布上，每帧不分配整帧内存
+            layers, duration = get_cross_fade_layers(video_clips, canvas_size=canvas_size, cross_fade_duration=cross_fade_duration)
+            layers.append(get_subtitle_layer(subtitle_path, canvas_size))
+            if cover_path:
+                layers.extend(get_overlay_layers(cover_path, opened_clips, time_offset=time_offset,
+                                                 canvas_size=canvas_size, sources=overlay_sources))
+
+            canvases[name] = render_layers(layers, canvas_size=canvas_size, duration=duration)
+            opened_clips.append(canvases[name])
+
+        # 添加音频
+        audio_clip = AudioFileClip(audio_path)
+        opened_clips.append(audio_clip)
+        video_clip = canvases.pop(None).set_audio(audio_clip)
+
+        # 保存合成的视频及各分辨率版本
+        write_video(video_clip, video_output_path=video_output_path, renditions=renditions, rendition_clips=canvases)
+    finally:
+        close_clips(opened_clips)
 
-    # 添加音频
-    audio_clip = AudioFileClip(audio_path)
-    video_clip = video_clip.set_audio(audio_clip)
+    return video_clip
 
-    # 保存合成的视频
-    video_clip.write_videofile(filename=video_output_path, fps=30, audio_codec="aac", codec="mpeg4",
-                               bitrate='10000k', threads=os.cpu_count(), audio_bufsize=1000)
-    video_clip.close()
 
-    return video_clip
+def get_timeline_duration(timeline: List[Dict],
+                          cross_fade_duration: float = config["compose_params"]["cross_fade_duration"]) -> float:
+    """
+    获取时间线渲染出的片段时长，按编码的整帧数截断，与流复制拼接后片段在整个视频中占的时长一致
+    :param timeline: 时间线，见plan_video
+    :param cross_fade_duration: 转场时间
+    :return:
+    """
+    current_duration = 0  # 与get_cross_fade_layers的累加顺序一致，避免浮点误差导致帧数差一
+    for index, media in enumerate(timeline):
+        start = current_duration if index == 0 else current_duration - cross_fade_duration
+        current_duration = start + (media["duration"] if media["type"] == "image" else media["t_end"] - media["t_start"])
+
+    return int(current_duration * ENCODE_PARAMS["fps"]) / ENCODE_PARAMS["fps"]
+
+
+def get_segment_recipe(timeline: List[Dict], text: str, subtitle_voice: str, material_direction: str,
+                       cross_fade_duration: float = config["compose_params"]["cross_fade_duration"],
+                       cover_path: str = None, renditions: List[Dict] = (), time_offset: float = 0) -> Dict:
+    """
+    获取片段的配方，即决定片段渲染结果的全部输入：文本、配音人、素材及裁剪区间、封面、字幕样式和编码参数
+    :param timeline: 时间线，见plan_video
+    :param text: 字幕文本
+    :param subtitle_voice: 字幕配音人
+    :param material_direction: 素材方向
+    :param cross_fade_duration: 转场时间
+    :param cover_path: 叠加在片段中的封面路径
+    :param renditions: 片段额外输出的分辨率版本
+    :param time_offset: 片段在整个视频中的起始时间
+    :return:
+    """
+    recipe = {
+        "text": text,
+        "subtitle_voice": subtitle_voice,
+        "subtitle_length_limit": config["compose_params"]["subtitle_length_limit"],
+        "timeline": [dict(media, file=get_file_fingerprint(media["path"])) for media in timeline],
+        "material_direction": material_direction,
+        "cross_fade_duration": cross_fade_duration,
+        "cover": get_file_fingerprint(cover_path) if cover_path else None,
+        "overlays": [dict(overlay, file=get_file_fingerprint(
+            os.path.join(config["compose_params"]["media_root_path"], overlay["path"])))
+            for overlay in config["compose_params"]["overlays"]] if cover_path else None,
+        "size": [config["compose_params"]["background_width"], config["compose_params"]["background_height"],
+                 config["compose_params"]["horizontal_material_width"], config["compose_params"]["horizontal_material_height"]],
+        "subtitles": config["compose_params"]["subtitles"],
+        "encode": ENCODE_PARAMS,
+        "render_version": RENDER_VERSION,
+    }
+    if renditions:  # 不输出分辨率版本时配方不变，已有的片段缓存仍然有效
+        recipe["renditions"] = list(renditions)
+    if cover_path and any(get_file_type(overlay["path"]) == "video" for overlay in config["compose_params"]["overlays"]):
+        recipe["time_offset"] = round(time_offset, 3)  # 只有画中画的画面与片段的位置有关
+
+    return recipe
+
+
+def generate_video(subtitle: Subtitle, audio_path: str, subtitle_path: str, video_output_path: str,
+                   material_direction: str, cross_fade_duration: float = config["compose_params"]["cross_fade_duration"]) -> VideoClip:
+    """
+    生成视频
+    :param cross_fade_duration: 转场时间
+    :param subtitle: 字幕对象
+    :param audio_path: 音频文件路径
+    :param subtitle_path: 字幕文件路径
+    :param material_direction: 素材方向
+    :param video_output_path: 视频输出路径
+    :return:
+    """
+    timeline = plan_video(subtitle=subtitle, subtitle_filename=os.path.basename(subtitle_path),
+                          audio_duration=get_audio_duration(audio_path), material_direction=material_direction,
+                          cross_fade_duration=cross_fade_duration)
+
+    return render_video(timeline=timeline, audio_path=audio_path, subtitle_path=subtitle_path,
+                        video_output_path=video_output_path, material_direction=material_direction,
+                        cross_fade_duration=cross_fade_duration)
 
 
 def main():